@@ -11,38 +11,81 @@ from pages import (
     portfolioPerformance,
     heatWaves
 )
-from utils import Header, make_dash_table, stocks, plotly_colors, createEmptyDatasets
-import pandas as pd
+from utils import Header, make_dash_table, stocks, plotly_colors
+from refresh import ModelRefresher
+from recompute import RecomputeCoordinator
+from price_cache import prices
+from metadata_cache import metadata, quotePrice
+from portfolio_import import importer
+from valuation import PortfolioValuation, esg_fields
+from portfolio_risk import PortfolioRisk
+from model_cache import ModelCache
+from portfolio_store import portfolios, newSession
+import flask
+import logging
+import os
 import numpy as np
-import yfinance as yf
+import pandas as pd
 
 from pages.heatWaves import getTemperatureAnomaliesTSPlot
 
-# Make sure we start cleanly
-createEmptyDatasets()
+logger = logging.getLogger(__name__)
 
 app = dash.Dash(
     __name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}]
 )
 server = app.server
 
-# Describe the layout/ UI of the app
-app.layout = html.Div(
-    [dcc.Location(id="url", refresh=False), html.Div(id="page-content")]
-)
+# Fit the heat wave models in the background, the pages only read the
+# published results. Set MODEL_REFRESH=process when a separate worker
+# (python refresh.py) on the same host, sharing the data directory, does
+# this instead.
+refresher = ModelRefresher(heatWaves.refreshJobs, heatWaves.published)
+
+
+def startRefresher():
+    if os.environ.get("MODEL_REFRESH", "thread") == "thread":
+        refresher.start()
+
+
+# Threads do not survive a fork: when gunicorn preloads the app, every
+# worker starts the refresher after forking (see gunicorn.conf.py)
+if os.environ.get("PRELOAD_APP") != "1":
+    startRefresher()
+
+
+# Hit rates of the ticker metadata cache
+@server.route("/stats/metadata-cache")
+def metadataCacheStats():
+    return flask.jsonify(metadata.stats())
+
+
+# Describe the layout/ UI of the app, every browser tab gets its own
+# session and with it its own portfolio
+def serve_layout():
+    return html.Div(
+        [dcc.Store(id="session-id", storage_type="session",
+                   data=newSession()),
+         dcc.Location(id="url", refresh=False), html.Div(id="page-content")]
+    )
+
+
+app.layout = serve_layout
 
 # Update page when the menu is used to navigate
 @app.callback(
     Output("page-content", "children"),
-    Input("url", "pathname"))
+    Input("url", "pathname"),
+    State("session-id", "data"))
 def display_page(
-        pathname: str):
+        pathname: str,
+        session: str):
     if pathname == "/dash-financial-report/portfolio":
         return portfolio.create_layout(app)
     elif pathname == "/dash-financial-report/portfolioPerformance":
-        return portfolioPerformance.create_layout(app)
+        return portfolioPerformance.create_layout(app, session)
     elif pathname == "/dash-financial-report/heatWaves":
-        return heatWaves.create_layout(app)
+        return heatWaves.create_layout(app, session)
     else:
         return ourApproach.create_layout(app)
 
@@ -50,69 +93,85 @@ def display_page(
 ##########################
 # Portfolio page callbacks
 ##########################
+def importStatus(status: dict) -> str:
+    # Progress or result of the import of a file
+    if not status['finished']:
+        return "Importing {f}: {d} of {n} positions done...".format(
+            f=status['filename'], d=status['done'], n=status['total'])
+    message = "Imported {n} positions from {f}.".format(
+        n=status['imported'], f=status['filename'])
+    errors = status['errors']
+    if errors:
+        message += " Left out: " + "; ".join(errors[:10])
+        if len(errors) > 10:
+            message += " and {n} more".format(n=len(errors) - 10)
+    return message
+
+
 @app.callback(
     Output('table-portfolio-overview', "children"),
+    Output('import-status', "children"),
+    Output('import-progress', "disabled"),
     Input('Add-stock-button', 'n_clicks'),
+    Input('upload-portfolio', 'contents'),
+    Input('import-progress', 'n_intervals'),
+    State('upload-portfolio', 'filename'),
     State('stocks-selection', 'value'),
-    State('number-of-shares', 'value')
+    State('number-of-shares', 'value'),
+    State('session-id', 'data')
 )
 def update_portfolio(
         n_clicks: int,
+        contents: str,
+        n_intervals: int,
+        filename: str,
         stock_ticker: str,
-        number: str):
-    # Load the portfolio file because it contains all positions up to now
-    df_portfolio = pd.read_csv('data/df_portfolio.csv')
+        number: str,
+        session: str):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+
+    # A whole file of positions is imported in the background (the quotes
+    # take a while) and the page polls its progress. The portfolio changes
+    # once for all of them so that the returns are only computed again once.
+    if 'upload-portfolio.contents' in triggered and contents is not None:
+        if importer.running(session):
+            return dash.no_update, \
+                "Please wait until the current import is done.", False
+        status = importer.start(session, contents, filename)
+        return dash.no_update, importStatus(status), False
+    if 'import-progress.n_intervals' in triggered:
+        status = importer.status(session)
+        if status is None:
+            return dash.no_update, '', True
+        if not status['finished']:
+            return dash.no_update, importStatus(status), False
+        importer.discard(session)
+        return portfolioTable(session), importStatus(status), True
 
     # If the button has been clicked at least once (needed because dash
     # executes all callbacks during initial load)
     if n_clicks != 0:
-        # Get stock information from Yahoo finance
-        stock = yf.Ticker(stock_ticker)
-        price = (stock.info['bid'] + stock.info['ask'])/2
-        if price < 0.001:  # When stock market is closed, no bid or ask available
-            # Yahoo then returns 0
-            price = stock.info['previousClose']
+        # Get stock information from Yahoo finance (one cached request)
+        info = metadata.info(stock_ticker, ['bid', 'ask', 'previousClose',
+                                            'industry'])
+        price = quotePrice(info)
         # Number input is a string and needs to be converted
         # checkInputs callback provides a warning to the user when the
         # conversion fails and displays a warning message
         number = float(number)
-        value = round(number*price, 2)
-        industry = stock.info['industry']
-
-        # Add new information to the portfolio
-        df_portfolio = df_portfolio.append(
-            {'Ticker': stock_ticker,
-             'Name': stocks[stock_ticker],
-             'Number of Shares': round(number, 2),
-             'Price': round(price, 2),
-             'Value (USD)': value,
-             'Industry': industry},
-            ignore_index=True
-        )
+        industry = info['industry']
 
-        # When a person adds a position of a stock that is already in the
-        # portfolio, the position should be added to that stock. This piece
-        # of code ensures that every ticker is unique in the portfolio.
-        df_portfolio_per_comp = df_portfolio.groupby(
-            'Ticker', as_index=False).agg('sum')
-        df_portfolio = pd.merge(df_portfolio_per_comp.drop('Price', axis=1),
-                                df_portfolio[['Ticker', 'Name', "Industry", "Price"]].drop_duplicates(
-                                    "Name"),
-                                how='inner', on='Ticker')
-        df_portfolio = df_portfolio[[
-            'Ticker', 'Name', 'Number of Shares', 'Price', 'Value (USD)', 'Industry'
-        ]]
-
-        # Rounding errors because of float type can happen e.g. 17.0000000003
-        df_portfolio['Number of Shares'] = df_portfolio['Number of Shares'].apply(
-            lambda x: round(x, 2))
-        df_portfolio['Value (USD)'] = df_portfolio['Value (USD)'].apply(
-            lambda x: round(x, 2))
-
-        # Save portfolio so it can be used in other parts of the application
-        df_portfolio.to_csv('data/df_portfolio.csv', index=False)
+        # Add the shares to the position in the ledger, only that position
+        # and the industry totals are updated
+        portfolios.addPosition(session, stock_ticker, stocks[stock_ticker],
+                               round(number, 2), price, industry)
+    return portfolioTable(session), dash.no_update, dash.no_update
 
-    return dash_table.DataTable(
+
+def portfolioTable(session: str):
+    # The portfolio with all positions up to now
+    df_portfolio = portfolios.positions(session)
+    table = dash_table.DataTable(
         id='portfolio',
         columns=[{"name": i, "id": i} for i in df_portfolio.columns],
         data=df_portfolio.to_dict('records'),
@@ -126,33 +185,21 @@ def update_portfolio(
 
         style_as_list_view=True,
     )
+    return table
 
 
 @app.callback(
     Output('portfolio-description', 'children'),
-    Input('table-portfolio-overview', 'children')
+    Input('table-portfolio-overview', 'children'),
+    State('session-id', 'data')
 )
 def update_portfolio_text(
-    table  # Input not needed but otherwise syntax error
+    table,  # Input not needed but otherwise syntax error
+    session: str
 ):
-    # Loading the portfolio and extracting information from it
-    df_portfolio = pd.read_csv("data/df_portfolio.csv")
-    number_of_companies = df_portfolio.shape[0]
-    total_value = sum(df_portfolio['Value (USD)'])
-    largest_industry = (df_portfolio
-                        .groupby('Industry', as_index=False)
-                        .agg('sum')
-                        .sort_values('Value (USD)', ascending=False)
-                        ['Industry'].values[0])
-    largest_position = (df_portfolio
-                        .sort_values('Value (USD)', ascending=False)
-                        ['Name'].values[0])
-    largest_position_ticker = (df_portfolio
-                               .sort_values('Value (USD)', ascending=False)
-                               ['Ticker'].values[0])
-    largest_position_value = (df_portfolio
-                              .sort_values('Value (USD)', ascending=False)
-                              ['Value (USD)'].values[0])
+    # The totals and largest positions are kept up to date by the ledger
+    summary = portfolios.ledger(session).summary()
+    number_of_companies = summary['companies']
     if number_of_companies == 1:
         st = "stock"
     else:
@@ -161,34 +208,26 @@ def update_portfolio_text(
     return "The portfolio consists of {n} {st} and has a total value of {usd:,} US dollars. The majority of the funds is invested in the {ind} industry. The largest position is the one in the {lc} ({lct}) stock which has a value of {lcv:,} US dollars.".format(
         n=number_of_companies,
         st=st,
-        usd=round(total_value, 2),
-        ind=largest_industry,
-        lc=largest_position,
-        lct=largest_position_ticker,
-        lcv=largest_position_value
+        usd=summary['total'],
+        ind=summary['industry'],
+        lc=summary['name'],
+        lct=summary['ticker'],
+        lcv=summary['value']
     )
 
 
 @app.callback(
     Output('table-sector-diversification', "children"),
     Input('table-portfolio-overview', 'children'),
+    State('session-id', 'data')
 )
 def update_sector_diversification(
-    table  # Input not needed but otherwise syntax error
+    table,  # Input not needed but otherwise syntax error
+    session: str
 ):
-    # Load portfolio to calculate diversification
-    df_portfolio = pd.read_csv('data/df_portfolio.csv')
-    # Diversification based on total value
-    sd = df_portfolio.groupby('Industry', as_index=False).agg('sum')[
-        ['Industry', 'Value (USD)']]
-    sd.loc[:, 'Relative share'] = sd['Value (USD)'].apply(
-        lambda x: round(x/sum(sd['Value (USD)']), 4))  # Calculate relative share
-    # Give good names to columns
-    sd.columns = ['Industry', 'Total Value', 'Relative Value']
-    sd['Total Value'] = sd['Total Value'].apply(lambda x: round(x, 2))
-
-    # Save results so can be used in other parts e.g. figure
-    sd.to_csv('data/df_sector_diversification.csv', index=False)
+    # Diversification based on total value, computed once per version of the
+    # portfolio and shared with the figure
+    sd = portfolios.sectors(session)
     return dash_table.DataTable(
         id='sector-diversification',
         columns=[{"name": i, "id": i} for i in sd.columns],
@@ -206,13 +245,14 @@ def update_sector_diversification(
 
 @app.callback(
     Output('fig-sector-diversification', 'children'),
-    Input('table-sector-diversification', "children")
+    Input('table-sector-diversification', "children"),
+    State('session-id', 'data')
 )
 def update_sector_figure(
-    table
+    table,
+    session: str
 ):
-    sd = pd.read_csv('data/df_sector_diversification.csv')
-    sd.loc[:, 'empty'] = "nothing"
+    sd = portfolios.sectors(session).assign(empty="nothing")
     # Creating the figure
     fig = px.bar(sd, x="empty", y="Total Value", color="Industry",
                  title="Industry diversification", hover_data={'empty': False},
@@ -262,48 +302,98 @@ def checkInputs(
 ############################
 # Performance page callbacks
 ############################
+def computePortfolioReturns(session: str, cancelled) -> bool:
+    # Value history, beta and ESG scores of the portfolio of a session, run
+    # by the coordinator. Stops without publishing when the portfolio
+    # changed in the meantime (cancelled).
+    version = portfolios.positionsVersion(session)
+    companies = portfolios.positions(session)
+    if companies.empty or portfolios.isCurrent(session):
+        return False
+    tickers = list(companies['Ticker'])
+    # Cached prices (only new days are downloaded), the company details come
+    # from the metadata cache and missing ones are fetched in parallel
+    closes = prices.history(tickers, period='10y')
+    if cancelled():
+        return False
+    details = metadata.details(tickers, fields=['beta'])
+    if cancelled():
+        return False
+
+    # Value, beta and ESG scores of the portfolio on one aligned price matrix
+    valuation = PortfolioValuation(
+        closes, companies.set_index('Ticker')['Number of Shares'],
+        betas=pd.Series({ticker: details[ticker]['info']['beta']
+                         for ticker in tickers}),
+        esg=pd.DataFrame([details[ticker]['sustainability']
+                          for ticker in tickers], index=tickers))
+    if cancelled():
+        return False
+
+    # Next-day VaR 1% in dollars of the current positions from a GARCH(1,1)
+    # per ticker and DCC correlations, the fits are cached per ticker. A
+    # short common history, more than max_risk_tickers tickers or a model
+    # that cannot be estimated (e.g. two tickers with the same returns)
+    # leave it out: the page then shows the non-parametric VaR.
+    metrics = valuation.metrics[['beta'] + esg_fields].copy()
+    metrics['VaR'] = float('nan')
+    daily_returns = valuation.prices.pct_change().dropna()
+    if len(daily_returns) >= 250 and len(tickers) <= max_risk_tickers:
+        try:
+            risk = PortfolioRisk(daily_returns, cache=risk_cache)
+            risk.fit()
+            metrics['VaR'] = risk.VaR(valuation.positions.iloc[-1],
+                                      level=0.99)
+        except (np.linalg.LinAlgError, RuntimeError, ValueError):
+            logger.exception("No GARCH-DCC VaR for %s", session)
+        if cancelled():
+            return False
+
+    # Returns and metrics are published together and only for the version of
+    # the portfolio they were computed from
+    return portfolios.publishResult(session, version, valuation.value,
+                                    metrics)
+
+
+# Fitted per ticker GARCH and DCC models, in the directory of the heat wave
+# models so that they are purged together. The DCC estimation takes seconds
+# for tens of tickers, larger portfolios get the non-parametric VaR.
+risk_cache = ModelCache("data/model_cache")
+max_risk_tickers = 25
+
+
+def failedPortfolioReturns(session: str):
+    # The retries failed as well, the performance page says so instead of
+    # waiting for an update
+    portfolios.publishFailure(session, portfolios.positionsVersion(session))
+
+
+# Bursts of changes to a portfolio lead to one computation, a change during
+# a computation cancels it and starts a new one. A failed computation is
+# retried a few times.
+coordinator = RecomputeCoordinator(computePortfolioReturns, debounce=1.0,
+                                   on_failure=failedPortfolioReturns)
+
+
+@server.route("/stats/recompute")
+def recomputeStats():
+    return flask.jsonify(coordinator.stats())
+
+
 @app.callback(
     Output('filler', 'children'),
     Input('table-portfolio-overview', "children"),
+    State('session-id', 'data')
 )
 def getPortfolioReturns(
-    table  # not needed but otherwise syntax error
+    table,  # not needed but otherwise syntax error
+    session: str
 ):
-    companies = pd.read_csv('data/df_portfolio.csv')
-    portfolio_value = None
-    beta = 0.0
-    esg_env, esg_soc, esg_gov = 0.0, 0.0, 0.0
-    total_portfolio_value = sum(companies['Value (USD)'])
-    for index, row in companies.iterrows():
-        company = row['Ticker']
-        ticker_company = yf.Ticker(company)
-        returns = ticker_company.history(period='10y')['Close']
-        esg_env = ticker_company.sustainability['Value']['environmentScore']
-        esg_soc = ticker_company.sustainability['Value']['socialScore']
-        esg_gov = ticker_company.sustainability['Value']['governanceScore']
-        beta += (row['Value (USD)']/total_portfolio_value) * \
-            ticker_company.info['beta']
-        returns = returns[-2510:]
-        returns = np.array(returns)*row['Number of Shares']
-        if portfolio_value is None:
-            portfolio_value = returns
-        else:
-            portfolio_value = returns + portfolio_value
-    dates = yf.Ticker('AAPL').history(period='10y').index
-    returns = pd.DataFrame(portfolio_value, columns=['Return'])
-    returns.index = dates[-2510:]
-    returns.to_csv("data/df_portfolio_returns.csv")
-    with open('data/esg_env.txt', 'w') as f:
-        f.write(str(esg_env))
-    with open('data/esg_soc.txt', 'w') as f:
-        f.write(str(esg_soc))
-    with open('data/esg_gov.txt', 'w') as f:
-        f.write(str(esg_gov))
-    with open('data/beta.txt', 'w') as f:
-        f.write(str(beta))
+    # Computed in the background, the performance page shows the latest
+    # published result
+    coordinator.request(session)
     return ''
 
-    
 
 #########################
 # Heatwaves page callback
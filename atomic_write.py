@@ -0,0 +1,32 @@
+# Other required packages
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+##################
+# Public functions
+##################
+@contextmanager
+def atomicWrite(path: str, mode: str = 'wb'):
+    # Open a new temporary file next to path (unique per call, so threads
+    # and processes writing the same path never share one) and replace path
+    # with it once the block succeeded: readers see either the old or the
+    # new file, never a partial one. The temporary file is removed when the
+    # block fails.
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory or None,
+                               prefix=os.path.basename(path) + ".",
+                               suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,128 @@
+# Other required packages
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Utils functions and variables
+from utils import loadTemperatures
+
+
+##################
+# Helper functions
+##################
+def _optimizeDtypes(df: pd.DataFrame) -> pd.DataFrame:
+    # Smallest dtypes that keep the values: integers are downcast, floats
+    # only become float32 when that is lossless and repeated strings
+    # become categoricals
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_integer_dtype(values):
+            df[column] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values) and values.dtype != np.float32:
+            downcast = values.astype(np.float32)
+            if np.array_equal(downcast.astype(values.dtype).values,
+                              values.values, equal_nan=True):
+                df[column] = downcast
+        elif pd.api.types.is_string_dtype(values) and \
+                values.nunique() < len(values)/2:
+            df[column] = values.astype('category')
+    return df
+
+
+def readHeatwavesYearly(path: str) -> pd.DataFrame:
+    df = pd.read_table(path)
+    df.columns = ['notes', 'year', 'avg_max_temp', 'avg_heat_index']
+    return df
+
+
+def readHeatwavesCounty(path: str) -> pd.DataFrame:
+    df = pd.read_table(path)
+    df.columns = ['notes', 'county', 'county_code',
+                  'avg_max_temp', 'avg_heat_index']
+    return df
+
+
+def readTemperatures(path: str) -> pd.DataFrame:
+    # Calibrated temperatures from the memory mapped store built from path
+    return loadTemperatures()
+
+
+class DatasetRegistry:
+    def __init__(self):
+        # Static datasets shared by all pages. Every dataset is read once,
+        # with optimized dtypes, and read again when its file changes. The
+        # frames are shared: callers must not modify them (use
+        # get(name, copy=True) for a private copy).
+        self.readers = {}
+        self.frames = {}
+        self.lock = threading.Lock()
+
+    #################
+    # Private methods
+    #################
+    def __load(self, name: str, mtime: float) -> pd.DataFrame:
+        path, reader = self.readers[name]
+        frame = _optimizeDtypes(reader(path))
+        self.frames[name] = dict(frame=frame, mtime=mtime,
+                                 loaded=datetime.now(), derived={})
+        return frame
+
+    ################
+    # Public methods
+    ################
+    def register(self, name: str, path: str, reader=pd.read_csv):
+        # reader(path) returns the dataframe, e.g. pd.read_pickle
+        self.readers[name] = (path, reader)
+
+    def get(self, name: str, copy: bool = False) -> pd.DataFrame:
+        assert name in self.readers, \
+            "Unknown dataset: {n}".format(n=name)
+        mtime = os.path.getmtime(self.readers[name][0])
+        with self.lock:
+            entry = self.frames.get(name)
+            if entry is None or entry['mtime'] != mtime:
+                frame = self.__load(name, mtime)
+            else:
+                frame = entry['frame']
+        return frame.copy() if copy else frame
+
+    def derive(self, name: str, key: str, build):
+        # build(frame), e.g. a figure, computed once per version of the
+        # dataset and shared like the dataset itself
+        frame = self.get(name)
+        derived = self.frames[name]['derived']
+        if key not in derived:
+            derived[key] = build(frame)
+        return derived[key]
+
+    def loadAll(self):
+        for name in self.readers:
+            self.get(name)
+
+    def memoryUsage(self) -> pd.DataFrame:
+        # Size of every loaded dataset, to size the workers
+        report = [{'dataset': name, 'rows': len(entry['frame']),
+                   'columns': entry['frame'].shape[1],
+                   'bytes': entry['frame'].memory_usage(deep=True).sum(),
+                   'loaded': entry['loaded']}
+                  for name, entry in self.frames.items()]
+        return pd.DataFrame(report, columns=['dataset', 'rows', 'columns',
+                                             'bytes', 'loaded'])
+
+
+# Registry used by the pages
+registry = DatasetRegistry()
+registry.register("heat_waves_yearly", "data/df_heat_waves_yearly.txt",
+                  readHeatwavesYearly)
+registry.register("heat_waves_2020", "data/df_heat_waves_2020.txt",
+                  readHeatwavesCounty)
+registry.register("anomalies", "data/anomalies.pkl", pd.read_pickle)
+registry.register("temperatures", "data/dfmaxcel.pkl", readTemperatures)
+
+
+if __name__ == "__main__":
+    registry.loadAll()
+    print(registry.memoryUsage())
@@ -0,0 +1,293 @@
+# Other required packages
+import numpy as np
+
+
+####################################################################
+# Lightweight GARCH(1,1)(-X) estimator with a linear (constant/ARX) mean
+#
+#   r_t = X_t b + e_t,  e_t ~ N(0, sigma2_t)
+#   sigma2_t = omega*exp(Z_t d) + alpha*e_{t-1}**2 + beta*sigma2_{t-1}
+#
+# All functions work on a batch of series at once: returns have shape
+# (n_series, n_obs), regressors X (n_series, n_obs, k), the optional
+# variance regressors Z (n_series, n_obs, m) and parameters
+# (n_series, k+3+m) ordered as [b, omega, alpha, beta, d]. Without
+# variance regressors this is arch's GARCH(1,1), the exponential keeps
+# the variance intercept positive for any d.
+# The variance recursion is initialised with arch's exponentially
+# weighted backcast so the estimates can be compared with arch_model.
+####################################################################
+class GarchResult:
+    def __init__(self, params: np.ndarray, resid: np.ndarray,
+                 sigma2: np.ndarray, loglikelihood: np.ndarray,
+                 iterations: int):
+        self.params = params
+        self.resid = resid
+        self.sigma2 = sigma2
+        self.loglikelihood = loglikelihood
+        self.iterations = iterations
+
+    def forecast(self, variance_regressors: np.ndarray = None) -> np.ndarray:
+        # One-step-ahead variance forecast for every series, the variance
+        # regressors (n_series, m) are the values of the forecasted day
+        return varianceForecast(self.params, self.resid, self.sigma2,
+                                variance_regressors)
+
+
+##################
+# Helper functions
+##################
+def _asBatch(returns: np.ndarray, regressors: np.ndarray = None,
+             variance_regressors: np.ndarray = None) -> tuple:
+    returns = np.asarray(returns, dtype=float)
+    if regressors is None:
+        regressors = np.ones(returns.shape + (1,))
+    if variance_regressors is None:
+        variance_regressors = np.zeros(returns.shape + (0,))
+    regressors = np.asarray(regressors, dtype=float)
+    variance_regressors = np.asarray(variance_regressors, dtype=float)
+    if returns.ndim == 1:
+        returns = returns[None, :]
+        regressors = regressors[None, :]
+        variance_regressors = variance_regressors[None, :]
+    if regressors.ndim == 2:
+        regressors = regressors[:, :, None]
+    if variance_regressors.ndim == 2:
+        variance_regressors = variance_regressors[:, :, None]
+    assert regressors.shape[:2] == returns.shape, \
+        "Regressors should have one row per observation"
+    assert variance_regressors.shape[:2] == returns.shape, \
+        "Variance regressors should have one row per observation"
+    return returns, regressors, variance_regressors
+
+
+def _project(params: np.ndarray, k: int) -> np.ndarray:
+    # Map parameters onto omega > 0, alpha, beta >= 0, alpha + beta < 1
+    params = params.copy()
+    params[:, k] = np.maximum(params[:, k], 1e-8)
+    params[:, k+1:k+3] = np.maximum(params[:, k+1:k+3], 0)
+    persistence = params[:, k+1] + params[:, k+2]
+    shrink = np.where(persistence > 0.9999, 0.9999/persistence, 1)
+    params[:, k+1:k+3] *= shrink[:, None]
+    return params
+
+
+def _negativeLoglikelihood(resid: np.ndarray, sigma2: np.ndarray) -> np.ndarray:
+    return 0.5*np.sum(np.log(2*np.pi) + np.log(sigma2) + resid**2/sigma2,
+                      axis=1)
+
+
+def _scores(params: np.ndarray, returns: np.ndarray, regressors: np.ndarray,
+            variance_regressors: np.ndarray, backcast: np.ndarray) -> tuple:
+    # Per observation gradients of the negative loglikelihood, the
+    # derivatives of sigma2 follow the same recursion as sigma2 itself
+    k = regressors.shape[2]
+    resid, sigma2 = garchFilter(params, returns, regressors, backcast,
+                                variance_regressors)
+    alpha, beta = params[:, k+1], params[:, k+2]
+    intercept = np.exp(np.einsum('ntm,nm->nt', variance_regressors,
+                                 params[:, k+3:]))
+    n, T = returns.shape
+    d_sigma2 = np.zeros((n, T, params.shape[1]))
+    d_sigma2[:, 1:, :k] = (-2*alpha[:, None, None]*resid[:, :-1, None]
+                           * regressors[:, :-1, :])
+    d_sigma2[:, :, k] = intercept
+    d_sigma2[:, 0, k+1] = backcast
+    d_sigma2[:, 1:, k+1] = resid[:, :-1]**2
+    d_sigma2[:, 0, k+2] = backcast
+    d_sigma2[:, 1:, k+2] = sigma2[:, :-1]
+    d_sigma2[:, :, k+3:] = ((params[:, k][:, None]*intercept)[:, :, None]
+                            * variance_regressors)
+    for t in range(1, T):
+        d_sigma2[:, t] += beta[:, None]*d_sigma2[:, t-1]
+    scores = (0.5*(1/sigma2 - resid**2/sigma2**2))[:, :, None]*d_sigma2
+    scores[:, :, :k] -= (resid/sigma2)[:, :, None]*regressors
+    return scores, _negativeLoglikelihood(resid, sigma2)
+
+
+def _fixedParameters(regressors: np.ndarray,
+                     variance_regressors: np.ndarray) -> np.ndarray:
+    # Parameters that cannot be identified and are kept at 0: regressors
+    # that are all zero or constant after an earlier constant regressor
+    # (e.g. a heatwave dummy of a window without heatwave days) and
+    # constant variance regressors, which only rescale omega
+    constant = np.all(regressors == regressors[:, :1, :], axis=1)
+    nonzero = constant & np.any(regressors != 0, axis=1)
+    earlier = np.cumsum(nonzero, axis=1) - nonzero > 0
+    fixed_mean = constant & (~nonzero | earlier)
+    fixed_variance = np.all(
+        variance_regressors == variance_regressors[:, :1, :], axis=1)
+    no_garch = np.zeros((regressors.shape[0], 3), dtype=bool)
+    return np.concatenate([fixed_mean, no_garch, fixed_variance], axis=1)
+
+
+def _startingValues(returns: np.ndarray, regressors: np.ndarray,
+                    variance_regressors: np.ndarray,
+                    fixed: np.ndarray) -> tuple:
+    # OLS for the mean, a small grid (like arch) for the variance parameters.
+    # The pseudo-inverse keeps the coefficients of the fixed regressors,
+    # left out of the OLS, at 0.
+    k = regressors.shape[2]
+    regressors_ols = regressors*~fixed[:, None, :k]
+    xtx = np.einsum('ntk,ntl->nkl', regressors_ols, regressors_ols)
+    xty = np.einsum('ntk,nt->nk', regressors_ols, returns)
+    b = np.einsum('nkl,nl->nk', np.linalg.pinv(xtx), xty)
+    resid = returns - np.einsum('ntk,nk->nt', regressors, b)
+    backcast = garchBackcast(resid)
+    variance = np.mean(resid**2, axis=1)
+    d = np.zeros((returns.shape[0], variance_regressors.shape[2]))
+    best, best_nll = None, np.full(returns.shape[0], np.inf)
+    for alpha in [0.01, 0.05, 0.1, 0.2]:
+        for persistence in [0.5, 0.9, 0.99]:
+            omega = variance*(1 - persistence)
+            candidate = np.column_stack(
+                [b, omega, np.full_like(omega, alpha),
+                 np.full_like(omega, persistence - alpha), d])
+            nll = _negativeLoglikelihood(
+                *garchFilter(candidate, returns, regressors, backcast,
+                             variance_regressors))
+            better = nll < best_nll
+            best = candidate if best is None else np.where(
+                better[:, None], candidate, best)
+            best_nll = np.where(better, nll, best_nll)
+    return best, backcast
+
+
+##################
+# Public functions
+##################
+def garchBackcast(resid: np.ndarray) -> np.ndarray:
+    # Exponentially weighted average of the first squared residuals
+    resid = np.atleast_2d(resid)
+    tau = min(75, resid.shape[1])
+    weights = 0.94**np.arange(tau)
+    weights = weights/np.sum(weights)
+    return resid[:, :tau]**2 @ weights
+
+
+def garchFilter(params: np.ndarray, returns: np.ndarray,
+                regressors: np.ndarray = None,
+                backcast: np.ndarray = None,
+                variance_regressors: np.ndarray = None) -> tuple:
+    returns, regressors, variance_regressors = _asBatch(
+        returns, regressors, variance_regressors)
+    params = np.atleast_2d(params)
+    k = regressors.shape[2]
+    resid = returns - np.einsum('ntk,nk->nt', regressors, params[:, :k])
+    if backcast is None:
+        backcast = garchBackcast(resid)
+    omega = params[:, k][:, None]*np.exp(
+        np.einsum('ntm,nm->nt', variance_regressors, params[:, k+3:]))
+    alpha, beta = params[:, k+1], params[:, k+2]
+    resid2 = resid**2
+    sigma2 = np.empty(returns.shape)
+    sigma2[:, 0] = omega[:, 0] + (alpha + beta)*backcast
+    for t in range(1, returns.shape[1]):
+        sigma2[:, t] = omega[:, t] + alpha*resid2[:, t-1] + beta*sigma2[:, t-1]
+    return resid, sigma2
+
+
+def varianceForecast(params: np.ndarray, resid: np.ndarray,
+                     sigma2: np.ndarray,
+                     variance_regressors: np.ndarray = None) -> np.ndarray:
+    params = np.atleast_2d(params)
+    if variance_regressors is None:
+        variance_regressors = np.zeros((params.shape[0], 0))
+    variance_regressors = np.atleast_2d(variance_regressors)
+    m = variance_regressors.shape[1]
+    omega, alpha, beta = params[:, -m-3], params[:, -m-2], params[:, -m-1]
+    omega = omega*np.exp(
+        np.sum(variance_regressors*params[:, params.shape[1]-m:], axis=1))
+    return (omega + alpha*np.atleast_2d(resid)[:, -1]**2 +
+            beta*np.atleast_2d(sigma2)[:, -1])
+
+
+def fitGarch(returns: np.ndarray, regressors: np.ndarray = None,
+             variance_regressors: np.ndarray = None,
+             max_iterations: int = 100, tolerance: float = 1e-9) -> GarchResult:
+    # Maximum likelihood with quasi-Newton (BFGS started from BHHH) steps,
+    # every series in the batch is optimized simultaneously with its own
+    # curvature and step size. Series are standardized while estimating
+    # and the estimates are scaled back.
+    returns, regressors, variance_regressors = _asBatch(
+        returns, regressors, variance_regressors)
+    k = regressors.shape[2]
+    n_params = k + 3 + variance_regressors.shape[2]
+    scale = np.std(returns, axis=1)
+    scale[scale == 0] = 1
+    returns = returns/scale[:, None]
+
+    fixed = _fixedParameters(regressors, variance_regressors)
+    params, backcast = _startingValues(returns, regressors,
+                                       variance_regressors, fixed)
+    active = np.ones(returns.shape[0], dtype=bool)
+    inverse_hessian, previous = None, None
+    iterations = 0
+    while active.any() and iterations < max_iterations:
+        iterations += 1
+        scores, nll = _scores(params, returns, regressors,
+                              variance_regressors, backcast)
+        # Fixed parameters have no gradient and an identity curvature
+        # so they never move
+        scores = scores*~fixed[:, None, :]
+        gradient = np.sum(scores, axis=1)
+        if inverse_hessian is None:
+            # BHHH (outer product of the scores) as initial curvature
+            hessian = np.einsum('ntk,ntl->nkl', scores, scores)
+            hessian[:, np.arange(n_params), np.arange(n_params)] += fixed
+            inverse_hessian = np.linalg.inv(hessian + 1e-8*np.eye(n_params))
+        else:
+            # BFGS update of the inverse hessian of every series
+            s = params - previous[0]
+            y = gradient - previous[1]
+            sy = np.einsum('nk,nk->n', s, y)
+            update = sy > 1e-12
+            rho = np.where(update, 1/np.where(update, sy, 1), 0)
+            A = np.eye(n_params) - \
+                rho[:, None, None]*s[:, :, None]*y[:, None, :]
+            inverse_hessian = np.where(
+                update[:, None, None],
+                A @ inverse_hessian @ np.swapaxes(A, 1, 2) +
+                rho[:, None, None]*s[:, :, None]*s[:, None, :],
+                inverse_hessian)
+        direction = np.einsum('nkl,nl->nk', inverse_hessian, gradient)
+        previous = (params, gradient)
+
+        # Backtracking line search, series that cannot improve are done
+        step = np.ones(returns.shape[0])
+        accepted = ~active
+        new_params = params.copy()
+        new_nll = nll.copy()
+        for _ in range(20):
+            candidate = _project(params - step[:, None]*direction, k)
+            candidate_nll = _negativeLoglikelihood(
+                *garchFilter(candidate, returns, regressors, backcast,
+                             variance_regressors))
+            improved = ~accepted & (candidate_nll <= nll)
+            new_params[improved] = candidate[improved]
+            new_nll[improved] = candidate_nll[improved]
+            accepted |= improved
+            if accepted.all():
+                break
+            step = np.where(accepted, step, step/2)
+        active &= accepted & (nll - new_nll > tolerance*(1 + np.abs(nll)))
+        params = new_params
+
+    resid, sigma2 = garchFilter(params, returns, regressors, backcast,
+                                variance_regressors)
+    loglikelihood = -_negativeLoglikelihood(resid, sigma2)
+    # Undo the standardization
+    params[:, :k+1] *= scale[:, None]
+    params[:, k] *= scale
+    loglikelihood -= returns.shape[1]*np.log(scale)
+    return GarchResult(params, resid*scale[:, None], sigma2*scale[:, None]**2,
+                       loglikelihood, iterations)
+
+
+def rollingWindows(x: np.ndarray, window: int) -> np.ndarray:
+    # Read-only view with one row per window of consecutive observations
+    x = np.asarray(x, dtype=float)
+    windows = np.lib.stride_tricks.sliding_window_view(x, window, axis=0)
+    if x.ndim == 2:  # Regressors: (n_windows, window, k)
+        windows = np.swapaxes(windows, 1, 2)
+    return windows
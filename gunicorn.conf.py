@@ -0,0 +1,58 @@
+# Gunicorn settings, used by the Procfile
+import os
+
+# Build the app, the heavy imports, the static datasets and figures once in
+# the master and let the workers share them copy-on-write. PRELOAD_APP=0
+# gives every worker its own copy, e.g. to compare the memory reports.
+preload_app = os.environ.setdefault("PRELOAD_APP", "1") == "1"
+
+# Log the memory of a worker every this many requests
+memory_report_every = int(os.environ.get("MEMORY_REPORT_EVERY", 1000))
+
+
+def memoryUsage(pid="self") -> dict:
+    # Resident (RSS), proportional (PSS, shared pages divided over the
+    # processes sharing them) and private (USS) memory in MB
+    usage = {}
+    try:
+        with open("/proc/{pid}/smaps_rollup".format(pid=pid)) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    usage[parts[0].rstrip(':')] = int(parts[1])/1024
+    except OSError:  # Not on Linux
+        return {}
+    return {'rss': usage.get('Rss', 0), 'pss': usage.get('Pss', 0),
+            'uss': usage.get('Private_Clean', 0) +
+            usage.get('Private_Dirty', 0)}
+
+
+def memoryReport(pid="self") -> str:
+    usage = memoryUsage(pid)
+    if not usage:
+        return "memory usage not available"
+    return "pid {pid}: RSS {rss:.1f} MB, PSS {pss:.1f} MB, USS {uss:.1f} MB".format(
+        pid=os.getpid() if pid == "self" else pid, **usage)
+
+
+def when_ready(server):
+    if preload_app:
+        import preload
+        preload.warmUp()
+        preload.freeze()
+    server.log.info("Master %s", memoryReport())
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import app
+        app.startRefresher()
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker started, %s", memoryReport())
+
+
+def post_request(worker, req, environ, resp):
+    if worker.nr % memory_report_every == 0:
+        worker.log.info("After %s requests, %s", worker.nr, memoryReport())
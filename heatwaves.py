@@ -0,0 +1,148 @@
+# Atomic file replacement shared by all caches and stores
+from atomic_write import atomicWrite
+
+# Other required packages
+import numpy as np
+import pandas as pd
+
+
+##################
+# Helper functions
+##################
+def _hotRuns(values: np.ndarray, threshold: float, min_length: int) -> tuple:
+    # Start (inclusive) and end (exclusive) positions of the runs of at
+    # least min_length consecutive days above the threshold. Missing days
+    # interrupt a run.
+    hot = np.zeros(len(values) + 2, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        hot[1:-1] = values > threshold
+    changes = np.flatnonzero(hot[1:] != hot[:-1])
+    starts, ends = changes[::2], changes[1::2]
+    keep = ends - starts >= min_length
+    return starts[keep], ends[keep]
+
+
+def _asNanoseconds(timestamps) -> np.ndarray:
+    # Timestamps as int64 nanoseconds since the epoch. Numbers are read as
+    # unix seconds (e.g. Reddit created_utc), anything else is parsed by
+    # pandas (dates, strings, datetime64).
+    values = np.atleast_1d(np.asarray(timestamps))
+    if values.dtype.kind in 'iu':
+        return values.astype(np.int64)*10**9
+    if values.dtype.kind == 'f':
+        return np.round(values*1e9).astype(np.int64)
+    values = pd.DatetimeIndex(pd.to_datetime(values)).values
+    return values.astype('datetime64[ns]').astype(np.int64)
+
+
+##################
+# Public functions
+##################
+def detectHeatwaves(temperatures: pd.Series, threshold: float = 32.2,
+                    min_length: int = 3) -> tuple:
+    # A heatwave is a period of at least min_length consecutive days with a
+    # maximum temperature above the threshold, all days of the period are
+    # heatwave days. Returns the daily flags (0/1) and one row per heatwave.
+    assert min_length >= 1, "The minimum length should be at least one day"
+    values = np.asarray(temperatures, dtype=float)
+    starts, ends = _hotRuns(values, threshold, min_length)
+
+    # +1 at the start and -1 after the end of every run
+    steps = np.zeros(len(values) + 1, dtype=int)
+    steps[starts] += 1
+    steps[ends] -= 1
+    flags = pd.Series(np.cumsum(steps[:-1]), index=temperatures.index,
+                      name='heatwave')
+
+    # Maximum over every [start, end) slice at once
+    bounds = np.column_stack([starts, ends]).ravel()
+    peaks = np.maximum.reduceat(np.append(values, -np.inf), bounds)[::2] \
+        if len(starts) else np.empty(0)
+    events = pd.DataFrame({'start': temperatures.index[starts],
+                           'end': temperatures.index[ends - 1],
+                           'duration': ends - starts,
+                           'peak': peaks})
+    return flags, events
+
+
+class HeatwaveIndex:
+    def __init__(self, starts: np.ndarray, ends: np.ndarray,
+                 peaks: np.ndarray = None):
+        # Heatwaves as half-open intervals [start, end) in int64 nanoseconds,
+        # sorted and merged so that the starts and the ends are both
+        # increasing and every query is a binary search
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        assert starts.shape == ends.shape, \
+            "Provide one end for every start"
+        peaks = np.full(len(starts), np.nan) if peaks is None \
+            else np.asarray(peaks, dtype=float)
+        order = np.argsort(starts, kind='stable')
+        starts, ends, peaks = starts[order], ends[order], peaks[order]
+        # Merge overlapping or touching intervals
+        if len(starts):
+            reach = np.maximum.accumulate(ends)
+            new = np.ones(len(starts), dtype=bool)
+            new[1:] = starts[1:] > reach[:-1]
+            groups = np.flatnonzero(new)
+            starts, ends = starts[groups], np.maximum.reduceat(reach, groups)
+            peaks = np.fmax.reduceat(peaks, groups)
+        self.starts, self.ends, self.peaks = starts, ends, peaks
+
+    @classmethod
+    def fromTemperatures(cls, temperatures: pd.Series,
+                         threshold: float = 32.2, min_length: int = 3):
+        # Daily maximum temperatures, a heatwave lasts from the start of its
+        # first day until the end of its last day
+        _, events = detectHeatwaves(temperatures, threshold, min_length)
+        starts = _asNanoseconds(events.start.values)
+        ends = _asNanoseconds(events.end.values) + pd.Timedelta(days=1).value
+        return cls(starts, ends, events.peak.values)
+
+    @classmethod
+    def fromIntervals(cls, intervals: list):
+        # (start, end) pairs of timestamps or unix seconds, e.g. the
+        # histogram bins of RedditScrape.ipynb
+        intervals = list(intervals)
+        if not intervals:
+            return cls(np.empty(0), np.empty(0))
+        starts, ends = zip(*intervals)
+        return cls(_asNanoseconds(list(starts)), _asNanoseconds(list(ends)))
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            return cls(data['starts'], data['ends'], data['peaks'])
+
+    ##################
+    # Public functions
+    ##################
+    def save(self, path: str):
+        # Readers never see a partial file
+        with atomicWrite(path) as f:
+            np.savez(f, starts=self.starts, ends=self.ends, peaks=self.peaks)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def isHeatwave(self, timestamps) -> np.ndarray:
+        # Vectorized membership, one binary search per timestamp
+        t = _asNanoseconds(timestamps)
+        i = np.searchsorted(self.starts, t, side='right') - 1
+        return (i >= 0) & (t < self.ends[np.maximum(i, 0)]) \
+            if len(self) else np.zeros(len(t), dtype=bool)
+
+    def contains(self, timestamp) -> bool:
+        return bool(self.isHeatwave(timestamp)[0])
+
+    def overlapping(self, start, end) -> pd.DataFrame:
+        # Heatwaves that overlap the period [start, end]
+        a, b = _asNanoseconds(start)[0], _asNanoseconds(end)[0]
+        first = np.searchsorted(self.ends, a, side='right')
+        last = np.searchsorted(self.starts, b, side='right')
+        return self.events(slice(first, max(first, last)))
+
+    def events(self, rows: slice = slice(None)) -> pd.DataFrame:
+        return pd.DataFrame({'start': pd.to_datetime(self.starts[rows]),
+                             'end': pd.to_datetime(self.ends[rows]),
+                             'peak': self.peaks[rows]})
@@ -0,0 +1,139 @@
+# Other required packages
+import threading
+
+import pandas as pd
+
+position_columns: list = ['Ticker', 'Name', 'Number of Shares', 'Price',
+                          'Value (USD)', 'Industry']
+
+
+class PositionLedger:
+    def __init__(self, positions: list = []):
+        # Positions of a portfolio by ticker (dicts with the
+        # position_columns) with running totals per industry and overall.
+        # Adding to a position only updates that position and the totals.
+        self.positions = {}
+        self.industries = {}
+        self.total = 0.0
+        self.largest_position = None
+        self.largest_industry = None
+        self.version = 0
+        self.frames = {}  # (kind, version) -> frame derived from the ledger
+        self.lock = threading.RLock()
+        for position in positions:
+            self.add(position['Ticker'], position['Name'],
+                     position['Number of Shares'], position['Price'],
+                     position['Industry'], position['Value (USD)'])
+
+    @classmethod
+    def fromFrame(cls, positions: pd.DataFrame):
+        assert set(position_columns) <= set(positions.columns), \
+            "Dataframe should have the columns: {c}".format(
+                c=", ".join(position_columns))
+        return cls(positions[position_columns].to_dict('records'))
+
+    #################
+    # Private methods
+    #################
+    def __updateLargest(self, ticker: str, industry: str, change: float):
+        # The largest position and industry only change with the updated
+        # ones, unless those shrank: then all of them are compared
+        if change < 0 and ticker == self.largest_position:
+            self.largest_position = max(
+                self.positions,
+                key=lambda t: self.positions[t]['Value (USD)'])
+        elif self.largest_position is None or \
+                self.positions[ticker]['Value (USD)'] > \
+                self.positions[self.largest_position]['Value (USD)']:
+            self.largest_position = ticker
+        if change < 0 and industry == self.largest_industry:
+            self.largest_industry = max(self.industries,
+                                        key=self.industries.get)
+        elif self.largest_industry is None or \
+                self.industries[industry] > \
+                self.industries[self.largest_industry]:
+            self.largest_industry = industry
+
+    ################
+    # Public methods
+    ################
+    def add(self, ticker: str, name: str, shares: float, price: float,
+            industry: str, value: float = None) -> dict:
+        # Add shares bought at price to the position in ticker, a new
+        # position keeps the price and industry of its first purchase.
+        # Returns the updated position.
+        value = round(shares*price if value is None else value, 2)
+        with self.lock:
+            position = self.positions.get(ticker)
+            if position is None:
+                position = dict(zip(position_columns,
+                                    [ticker, name, 0.0, round(price, 2),
+                                     0.0, industry]))
+                self.positions[ticker] = position
+            # Rounding errors because of float type can happen e.g.
+            # 17.0000000003
+            position['Number of Shares'] = round(
+                position['Number of Shares'] + shares, 2)
+            position['Value (USD)'] = round(position['Value (USD)'] + value,
+                                            2)
+            industry = position['Industry']
+            self.industries[industry] = self.industries.get(industry, 0.0) + \
+                value
+            self.total += value
+            self.__updateLargest(ticker, industry, value)
+            self.version += 1
+            return dict(position)
+
+    def copy(self):
+        # Independent ledger with the same positions and totals, e.g. to
+        # change it before the change is stored
+        with self.lock:
+            ledger = PositionLedger()
+            ledger.positions = {ticker: dict(position) for ticker, position
+                                in self.positions.items()}
+            ledger.industries = dict(self.industries)
+            ledger.total = self.total
+            ledger.largest_position = self.largest_position
+            ledger.largest_industry = self.largest_industry
+            ledger.version = self.version
+            return ledger
+
+    def summary(self) -> dict:
+        # Number of positions, total value and the largest industry and
+        # position
+        with self.lock:
+            largest = self.positions.get(self.largest_position, {})
+            return dict(companies=len(self.positions),
+                        total=round(self.total, 2),
+                        industry=self.largest_industry,
+                        name=largest.get('Name'),
+                        ticker=largest.get('Ticker'),
+                        value=largest.get('Value (USD)'))
+
+    def frame(self) -> pd.DataFrame:
+        # The positions in the order they were first bought, shared: callers
+        # must not modify it
+        with self.lock:
+            key = ('positions', self.version)
+            if key not in self.frames:
+                self.frames = {k: v for k, v in self.frames.items()
+                               if k[1] == self.version}
+                self.frames[key] = pd.DataFrame(
+                    list(self.positions.values()), columns=position_columns)
+            return self.frames[key]
+
+    def sectors(self) -> pd.DataFrame:
+        # Industry, Total Value and Relative Value from the running totals
+        with self.lock:
+            key = ('sectors', self.version)
+            if key not in self.frames:
+                self.frames = {k: v for k, v in self.frames.items()
+                               if k[1] == self.version}
+                industries = sorted(self.industries)
+                sd = pd.DataFrame({'Industry': industries,
+                                   'Total Value': [self.industries[i]
+                                                   for i in industries]})
+                sd['Relative Value'] = (sd['Total Value']/self.total).round(4)
+                sd['Total Value'] = sd['Total Value'].round(2)
+                self.frames[key] = sd
+            return self.frames[key]
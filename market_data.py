@@ -0,0 +1,188 @@
+# Other required packages
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import yfinance as yf
+
+
+class MarketDataProvider(ABC):
+    def __init__(self, max_workers: int = 8, timeout: float = 20):
+        # Prices and company details for a list of tickers. Requests for
+        # several tickers run concurrently on at most max_workers threads
+        # and every request fails after timeout seconds.
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    ##################
+    # Provider methods
+    ##################
+    @abstractmethod
+    def history(self, tickers: list, period: str = "10y",
+                start: pd.Timestamp = None) -> pd.DataFrame:
+        # Daily (adjusted) closing prices, one column per ticker, of the last
+        # period or from start on
+        pass
+
+    @abstractmethod
+    def info(self, ticker: str) -> dict:
+        pass
+
+    @abstractmethod
+    def sustainability(self, ticker: str) -> dict:
+        # environmentScore, socialScore and governanceScore
+        pass
+
+    #################
+    # Private methods
+    #################
+    def __submit(self, fetch, tickers: list) -> dict:
+        return {ticker: self.executor.submit(fetch, ticker)
+                for ticker in dict.fromkeys(tickers)}
+
+    def __collect(self, futures: dict, deadline: float) -> dict:
+        # Results of requests that were started together, raises a
+        # TimeoutError when they are not all done by the deadline
+        return {ticker: future.result(timeout=max(deadline - time.time(), 0))
+                for ticker, future in futures.items()}
+
+    ################
+    # Public methods
+    ################
+    def fetchMany(self, fetch, tickers: list) -> dict:
+        # fetch(ticker) for every ticker at once
+        deadline = time.time() + self.timeout
+        return self.__collect(self.__submit(fetch, tickers), deadline)
+
+    def closes(self, tickers: list, period: str = "10y",
+               start: pd.Timestamp = None) -> pd.DataFrame:
+        # One batched history request, with the same timeout
+        future = self.executor.submit(self.history, list(tickers), period,
+                                      start)
+        return future.result(timeout=self.timeout)
+
+    def details(self, tickers: list) -> dict:
+        # Info and sustainability scores of every ticker, all requests in
+        # flight together
+        deadline = time.time() + self.timeout
+        infos = self.__submit(self.info, tickers)
+        scores = self.__submit(self.sustainability, tickers)
+        infos = self.__collect(infos, deadline)
+        scores = self.__collect(scores, deadline)
+        return {ticker: dict(info=infos[ticker],
+                             sustainability=scores[ticker])
+                for ticker in infos}
+
+    def snapshot(self, tickers: list, period: str = "10y") -> tuple:
+        # Prices and details of a portfolio: the batched history request and
+        # the detail requests are all in flight together
+        deadline = time.time() + self.timeout
+        tickers = list(dict.fromkeys(tickers))
+        history = self.executor.submit(self.history, tickers, period)
+        infos = self.__submit(self.info, tickers)
+        scores = self.__submit(self.sustainability, tickers)
+        closes = history.result(timeout=max(deadline - time.time(), 0))
+        infos = self.__collect(infos, deadline)
+        scores = self.__collect(scores, deadline)
+        return closes, {ticker: dict(info=infos[ticker],
+                                     sustainability=scores[ticker])
+                        for ticker in tickers}
+
+
+class YahooProvider(MarketDataProvider):
+    def history(self, tickers: list, period: str = "10y",
+                start: pd.Timestamp = None) -> pd.DataFrame:
+        # A single download for all tickers instead of one per ticker
+        if start is None:
+            data = yf.download(tickers, period=period, auto_adjust=True,
+                               threads=True, progress=False)
+        else:
+            data = yf.download(tickers, start=start.strftime("%Y-%m-%d"),
+                               auto_adjust=True, threads=True, progress=False)
+        closes = data['Close']
+        if isinstance(closes, pd.Series):  # Only one ticker
+            closes = closes.to_frame(tickers[0])
+        return closes[tickers]
+
+    def info(self, ticker: str) -> dict:
+        return yf.Ticker(ticker).info
+
+    def sustainability(self, ticker: str) -> dict:
+        scores = yf.Ticker(ticker).sustainability
+        # Yahoo has no scores for some tickers
+        return {} if scores is None else scores['Value'].to_dict()
+
+
+class FileProvider(MarketDataProvider):
+    def __init__(self, directory: str = "data/market_data",
+                 latency: float = 0, max_workers: int = 8,
+                 timeout: float = 20):
+        # Offline stand-in for tests and benchmarks: <ticker>.csv with Date
+        # and Close columns and <ticker>.json with the info and
+        # sustainability dictionaries. latency (seconds) simulates the
+        # network for every request.
+        super().__init__(max_workers, timeout)
+        self.directory = directory
+        self.latency = latency
+
+    ##################
+    # Helper functions
+    ##################
+    def __read(self, ticker: str) -> dict:
+        time.sleep(self.latency)
+        with open(os.path.join(self.directory, ticker + ".json")) as f:
+            return json.load(f)
+
+    ##################
+    # Provider methods
+    ##################
+    def history(self, tickers: list, period: str = "10y",
+                start: pd.Timestamp = None) -> pd.DataFrame:
+        time.sleep(self.latency)
+        closes = pd.concat(
+            [pd.read_csv(os.path.join(self.directory, ticker + ".csv"),
+                         index_col='Date', parse_dates=True)['Close']
+             .rename(ticker) for ticker in tickers], axis=1)
+        if start is None:
+            assert period.endswith("y"), "Period should be in years, e.g. 10y"
+            start = closes.index.max() - pd.DateOffset(years=int(period[:-1]))
+        return closes[closes.index >= start]
+
+    def info(self, ticker: str) -> dict:
+        return self.__read(ticker)['info']
+
+    def sustainability(self, ticker: str) -> dict:
+        return self.__read(ticker)['sustainability']
+
+    def save(self, ticker: str, closes: pd.Series, info: dict,
+             sustainability: dict):
+        # Store a ticker, e.g. recorded from the YahooProvider
+        os.makedirs(self.directory, exist_ok=True)
+        closes.rename('Close').rename_axis('Date').to_csv(
+            os.path.join(self.directory, ticker + ".csv"))
+        with open(os.path.join(self.directory, ticker + ".json"), 'w') as f:
+            json.dump(dict(info=info, sustainability=sustainability), f,
+                      default=str)
+
+
+def getProvider() -> MarketDataProvider:
+    # MARKET_DATA=file uses the offline files in data/market_data
+    if os.environ.get("MARKET_DATA", "yahoo") == "file":
+        return FileProvider()
+    return YahooProvider()
+
+
+if __name__ == "__main__":
+    # Record tickers from Yahoo finance for the offline provider, e.g.
+    # python market_data.py AAPL MSFT KO
+    import sys
+    tickers = sys.argv[1:]
+    closes, details = YahooProvider().snapshot(tickers)
+    files = FileProvider()
+    for ticker in tickers:
+        files.save(ticker, closes[ticker].dropna(), details[ticker]['info'],
+                   details[ticker]['sustainability'])
@@ -0,0 +1,139 @@
+# Market data
+from market_data import MarketDataProvider
+from price_cache import prices
+
+# Other required packages
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached value stays fresh, per group of fields
+ttls: dict = {'quote': 15,                    # bid, ask, previous close
+              'info': 3600*24,                # industry, beta, ...
+              'sustainability': 3600*24*7}    # ESG scores
+
+quote_fields: list = ['bid', 'ask', 'previousClose']
+
+
+def quotePrice(info: dict) -> float:
+    # Mid price, when the stock market is closed no bid or ask is available
+    # (Yahoo then returns 0) and the previous close is used
+    price = (info['bid'] + info['ask'])/2
+    if price < 0.001:
+        price = info['previousClose']
+    return price
+
+
+class MetadataCache:
+    def __init__(self, provider: MarketDataProvider, ttls: dict = ttls):
+        # Ticker info and sustainability scores with a time to live per
+        # field. Concurrent requests for the same missing ticker share one
+        # upstream request.
+        self.provider = provider
+        self.ttls = ttls
+        self.values = {}    # (source, ticker) -> (fetched, value)
+        self.inflight = {}  # (source, ticker) -> Future
+        self.lock = threading.Lock()
+        self.counts = {source: dict(hits=0, misses=0, coalesced=0)
+                       for source in ['info', 'sustainability']}
+
+    #################
+    # Private methods
+    #################
+    def __ttl(self, fields: list) -> float:
+        return self.ttls['quote'] if set(fields) & set(quote_fields) \
+            else self.ttls['info']
+
+    def __get(self, source: str, ticker: str, ttl: float, fetch):
+        key = (source, ticker)
+        with self.lock:
+            if key in self.values and \
+                    time.time() - self.values[key][0] < ttl:
+                self.counts[source]['hits'] += 1
+                return self.values[key][1]
+            leader = key not in self.inflight
+            if leader:
+                self.inflight[key] = Future()
+                self.counts[source]['misses'] += 1
+            else:
+                self.counts[source]['coalesced'] += 1
+            future = self.inflight[key]
+        if leader:
+            try:
+                value = fetch(ticker)
+                with self.lock:
+                    self.values[key] = (time.time(), value)
+                future.set_result(value)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.inflight[key]
+        return future.result(timeout=self.provider.timeout)
+
+    ################
+    # Public methods
+    ################
+    def info(self, ticker: str, fields: list) -> dict:
+        # The requested info fields, quotes are refreshed after seconds and
+        # the other fields after a day
+        info = self.__get('info', ticker, self.__ttl(fields),
+                          self.provider.info)
+        return {field: info[field] for field in fields}
+
+    def sustainability(self, ticker: str) -> dict:
+        return self.__get('sustainability', ticker,
+                          self.ttls['sustainability'],
+                          self.provider.sustainability)
+
+    def details(self, tickers: list, fields: list = ['beta']) -> dict:
+        # Info fields and sustainability scores of every ticker, missing
+        # values are all requested in parallel
+        deadline = time.time() + self.provider.timeout
+        executor = self.provider.executor
+        futures = {ticker: (executor.submit(self.info, ticker, fields),
+                            executor.submit(self.sustainability, ticker))
+                   for ticker in dict.fromkeys(tickers)}
+        return {ticker: dict(
+            info=info.result(timeout=max(deadline - time.time(), 0)),
+            sustainability=scores.result(
+                timeout=max(deadline - time.time(), 0)))
+            for ticker, (info, scores) in futures.items()}
+
+    def infos(self, tickers: list, fields: list) -> dict:
+        # Info fields of many tickers (e.g. a portfolio import), all missing
+        # ones requested in parallel. The deadline grows with the number of
+        # requests per worker. Tickers that fail or are not done by the
+        # deadline are left out, missing fields are None.
+        tickers = list(dict.fromkeys(tickers))
+        rounds = -(-len(tickers)//self.provider.max_workers)
+        deadline = time.time() + self.provider.timeout*max(rounds, 1)
+        futures = {ticker: self.provider.executor.submit(
+            self.__get, 'info', ticker, self.__ttl(fields),
+            self.provider.info) for ticker in tickers}
+        infos = {}
+        for ticker, future in futures.items():
+            try:
+                info = future.result(timeout=max(deadline - time.time(), 0))
+                infos[ticker] = {field: info.get(field) for field in fields}
+            except Exception as e:
+                logger.warning("No info for %s: %r", ticker, e)
+        return infos
+
+    def stats(self) -> dict:
+        # Hits, misses, coalesced requests and hit rate per source
+        with self.lock:
+            stats = {source: dict(counts) for source, counts
+                     in self.counts.items()}
+        for counts in stats.values():
+            requests = counts['hits'] + counts['misses'] + counts['coalesced']
+            counts['hit_rate'] = (counts['hits'] + counts['coalesced']) / \
+                requests if requests else None
+        return stats
+
+
+# Shared by the app and the pages
+metadata = MetadataCache(prices.provider)
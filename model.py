@@ -1,50 +1,325 @@
 # Models
 from arch import arch_model
 import statsmodels.api as sm
+from garch import fitGarch, garchFilter, rollingWindows, varianceForecast
+from model_cache import ModelCache, fingerprint
 
 # Other required packages
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 # Surpress warnings
 import warnings
 warnings.filterwarnings("ignore")
 
+backends: dict = {'thread': ThreadPoolExecutor,
+                  'process': ProcessPoolExecutor}
 
-class Model:
+
+def _rollingGarchChunk(scaled: np.ndarray, refit_every: int,
+                       warm_start: bool) -> list:
+    # One-step-ahead variance forecasts of a constant mean GARCH(1,1) for
+    # every 200-observation window scaled[j:j+200] in the chunk.
+    # The one-step-ahead variance is omega + alpha*resid**2 + beta*sigma2,
+    # so between two refits the conditional variance state is advanced with
+    # the newest return instead of estimating a new model for every window.
+    # Module level function so that it can be sent to a process pool.
+    estimates = []
+    params = None
+    for j in range(len(scaled) - 199):
+        if j % refit_every == 0:
+            am = arch_model(scaled[j:j+200])
+            am = am.fit(disp="off",
+                        starting_values=params if warm_start else None)
+            params = am.params.values
+            mu, omega, alpha, beta = params
+            sigma2 = np.asarray(am.conditional_volatility)[-1]**2
+            resid = np.asarray(am.resid)[-1]
+        else:
+            # Filter the newest observation with the fixed parameters
+            sigma2 = omega + alpha*resid**2 + beta*sigma2
+            resid = scaled[j+199] - mu
+        estimates.append(omega + alpha*resid**2 + beta*sigma2)
+    return estimates
+
+
+def _forecastMany(state: dict, exogenous_grid: list,
+                  horizons: list) -> pd.DataFrame:
+    # Forecasts for every scenario (exogenous value held constant over the
+    # horizon) and horizon in one vectorized pass. The expected GARCH(1,1)
+    # variance decays geometrically towards its long run level:
+    # E[sigma2_{T+h}] = lr + (alpha+beta)**(h-1) * (sigma2_{T+1} - lr)
+    x = np.asarray(exogenous_grid, dtype=float)[:, None]
+    h = np.arange(1, max(horizons) + 1)[None, :]
+    omega = state['omega']*np.exp(state['delta']*x)
+    persistence = state['alpha'] + state['beta']
+    first = (omega + state['alpha']*state['resid'][-1]**2 +
+             state['beta']*state['sigma2'][-1])
+    long_run = omega/(1 - persistence)
+    variance = long_run + persistence**(h - 1)*(first - long_run)
+    intercept, slope, dummy = state['correction']
+    variance = np.maximum(intercept + slope*variance + dummy*x, 1e-12)
+    mean = np.broadcast_to(state['const'] + state['coef']*x, variance.shape)
+
+    # Returns are uncorrelated so the variance of the cumulative return is
+    # the sum of the daily variances
+    columns = np.asarray(horizons) - 1
+    return pd.DataFrame({
+        'exogenous': np.repeat(x[:, 0], len(columns)),
+        'horizon': np.tile(np.asarray(horizons), len(x)),
+        'mean': mean[:, columns].ravel(),
+        'volatility': np.sqrt(variance[:, columns]).ravel(),
+        'cumulative_mean': np.cumsum(mean, axis=1)[:, columns].ravel(),
+        'cumulative_volatility': np.sqrt(
+            np.cumsum(variance, axis=1)[:, columns]).ravel()})
+
+
+def _advance(state: dict, returns: np.ndarray,
+             exogenous: np.ndarray) -> tuple:
+    # Run the fitted recursion over new observations with fixed parameters,
+    # returns the new residuals, variances and loglikelihood contributions
+    resid = np.empty(len(returns))
+    sigma2 = np.empty(len(returns))
+    last_resid, last_sigma2 = state['resid'][-1], state['sigma2'][-1]
+    for t in range(len(returns)):
+        last_sigma2 = (state['omega']*np.exp(state['delta']*exogenous[t]) +
+                       state['alpha']*last_resid**2 +
+                       state['beta']*last_sigma2)
+        last_resid = returns[t] - state['const'] - state['coef']*exogenous[t]
+        resid[t], sigma2[t] = last_resid, last_sigma2
+    loglikelihood = -0.5*(np.log(2*np.pi) + np.log(sigma2) + resid**2/sigma2)
+    return resid, sigma2, loglikelihood
+
+
+def _append(series: pd.Series, values) -> pd.Series:
+    # Values without an index continue a positional index
+    if not isinstance(values, pd.Series):
+        values = pd.Series(np.asarray(values, dtype=float),
+                           index=pd.RangeIndex(len(series),
+                                               len(series) + len(values)),
+                           name=series.name)
+    return pd.concat([series, values])
+
+
+class RefitPolicy:
+    def __init__(self, every: int = 20, drift: float = 1.0,
+                 min_observations: int = 5):
+        # A full re-estimation is triggered after `every` updates, or when
+        # the average loglikelihood of the (at least min_observations)
+        # observations absorbed since the last fit falls more than `drift`
+        # below the in-sample average, i.e. the parameters no longer fit
+        self.every = every
+        self.drift = drift
+        self.min_observations = min_observations
+
+    def needsRefit(self, n_updates: int, in_sample: float,
+                   new: np.ndarray) -> bool:
+        if self.every is not None and n_updates >= self.every:
+            return True
+        return (len(new) >= self.min_observations and
+                in_sample - np.mean(new) > self.drift)
+
+
+class FilteredModel:
+    # State handling shared by Model and GarchXModel: the fit is restored
+    # from the cache when possible, forecasts are memoized per regressor
+    # value and update() advances the fitted recursion until the refit
+    # policy asks for a new estimation. Subclasses implement estimate(),
+    # getState(), setState() and simulationState().
+    def __init__(self, returns: pd.Series,
+                 exogenous_regressor: pd.Series = None,
+                 hyperparameters: dict = {},
+                 refit_policy: RefitPolicy = None):
+        self.r = returns
+        self.ex = exogenous_regressor
+        # Everything that changes the fitted model, used as cache key
+        self.hyperparameters = dict(hyperparameters)
+        # New observations are absorbed by update() until the policy asks
+        # for a full re-estimation
+        self.refit_policy = refit_policy or RefitPolicy()
+        self.cache = None
+        self.forecasts = {}
+
+    ################
+    # Public methods
+    ################
+    def fingerprint(self) -> str:
+        return fingerprint(self.r, self.ex, **self.hyperparameters)
+
+    def fit(self, cache: ModelCache = None):
+        # When a cache is given, a model fitted earlier on the same data and
+        # settings is restored instead of estimated again
+        self.cache = cache
+        if cache is not None:
+            self.key = self.fingerprint()
+            state = cache.get(self.key)
+            if state is not None:
+                self.setState(state)
+                return
+        self.estimate()
+        self.forecasts = {}
+        if cache is not None:
+            cache.put(self.key, self.getState())
+
+    def forecastOne(self, exogenous: list = None) -> tuple:
+        # One-step-ahead mean and volatility, includes the updates
+        x = 0 if exogenous is None else exogenous[0]
+        forecasts = self.forecast_many(exogenous_grid=[x], horizons=[1])
+        return forecasts['mean'][0], forecasts['volatility'][0]
+
+    def forecast(self, exogenous: int = None):
+        key = None if exogenous is None else tuple(exogenous)
+        if key in self.forecasts:
+            return self.forecasts[key]
+        mean, vol = self.forecastOne(exogenous)
+        self.forecasts[key] = (mean, vol)
+        if self.cache is not None:
+            self.cache.put(self.key, self.getState())
+        return mean, vol
+
+    def appendObservations(self, new_returns, new_exog=None):
+        self.r = _append(self.r, new_returns)
+        if self.ex is not None:
+            self.ex = _append(self.ex, np.zeros(len(new_returns))
+                              if new_exog is None else new_exog)
+
+    def update(self, new_returns, new_exog=None) -> bool:
+        # Absorb new observations with the fitted parameters, this only
+        # advances the variance recursion. Returns True when the refit
+        # policy triggered a full re-estimation instead.
+        x = np.zeros(len(new_returns)) if new_exog is None \
+            else np.asarray(new_exog, dtype=float)
+        resid, sigma2, loglikelihood = _advance(
+            self.simulationState(), np.asarray(new_returns, dtype=float), x)
+        self.appendObservations(new_returns, new_exog)
+        self.resid = np.append(self.resid, resid)
+        self.sigma2 = np.append(self.sigma2, sigma2)
+        self.updates = np.append(self.updates, loglikelihood)
+        self.forecasts = {}
+        if self.refit_policy.needsRefit(len(self.updates), self.in_sample,
+                                        self.updates):
+            self.fit(cache=self.cache)
+            return True
+        if self.cache is not None:
+            self.key = self.fingerprint()
+            self.cache.put(self.key, self.getState())
+        return False
+
+    def forecast_many(self, exogenous_grid: list = [0],
+                      horizons: list = [1]) -> pd.DataFrame:
+        # All scenario x horizon forecasts at once, see _forecastMany
+        return _forecastMany(self.simulationState(), exogenous_grid, horizons)
+
+
+class Model(FilteredModel):
     def __init__(self, returns: pd.Series,
                  exogenous_regressor: pd.Series = None,
                  mean_model: str = "ARX",
                  volatility_model: str = "Garch",
-                 p: int = 1, q: int = 1):
+                 p: int = 1, q: int = 1,
+                 refit_every: int = 1,
+                 warm_start: bool = True,
+                 backend: str = "serial",
+                 n_jobs: int = None,
+                 chunk_size: int = 25,
+                 engine: str = "native",
+                 refit_policy: RefitPolicy = None):
+        assert engine in ["arch", "native"], \
+            "engine should be one of: arch, native"
+        assert refit_every >= 1, "refit_every should be a positive integer"
+        assert backend == "serial" or backend in backends, \
+            "backend should be one of: serial, thread, process"
+        assert chunk_size >= 1, "chunk_size should be a positive integer"
+        super().__init__(returns, exogenous_regressor,
+                         dict(mean_model=mean_model,
+                              volatility_model=volatility_model,
+                              p=p, q=q, refit_every=refit_every,
+                              warm_start=warm_start,
+                              chunk_size=chunk_size, engine=engine),
+                         refit_policy)
         # Define initial volatility model
-        self.r = returns
         self.arch_model = arch_model(self.r,
                                      x=exogenous_regressor,
                                      mean=mean_model,
                                      vol=volatility_model,
                                      p=p, q=q
                                      )
-        self.ex = exogenous_regressor
+        # Settings of the rolling backtest used for the linear correction:
+        # the window GARCH model is re-estimated every refit_every steps and
+        # only filtered in between, warm_start reuses the previous estimates
+        # as starting values of the optimizer
+        self.refit_every = refit_every
+        self.warm_start = warm_start
+        # The backtest windows are split in chunks of chunk_size windows that
+        # are estimated independently (serially or on a thread/process pool
+        # with n_jobs workers). Chunks never depend on the number of workers
+        # so every backend returns exactly the same predictions.
+        self.backend = backend
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        # The native engine (garch.py) estimates all backtest windows at once
+        # in NumPy instead of going through arch for every window, backend
+        # and warm_start only apply to the arch engine
+        self.engine = engine
         np.random.seed(123456)
 
     #################
     # Private methods
     #################
+    def __filtered(self):
+        # Residuals and variances advanced by update(), starting from the fit
+        self.resid = np.asarray(self.res.resid)
+        self.sigma2 = np.asarray(self.res.conditional_volatility)**2
+        self.in_sample = self.res.loglikelihood/len(self.resid)
+        self.updates = np.empty(0)
+
+    def __isGarch11(self) -> bool:
+        return (self.hyperparameters['volatility_model'].lower() == "garch"
+                and self.hyperparameters['p'] == 1
+                and self.hyperparameters['q'] == 1)
+
+    def __hasClosedForm(self) -> bool:
+        # The closed-form recursions (_advance, _forecastMany) only model a
+        # GARCH(1,1) with a constant (ARX without lags), or zero mean
+        return self.__isGarch11() and \
+            self.hyperparameters['mean_model'].lower() in \
+            ["arx", "constant", "zero"]
+
+    def __map(self, function, chunks: list) -> list:
+        # Apply the function to every chunk, results are returned in order
+        if self.backend == "serial":
+            return [function(chunk, self.refit_every, self.warm_start)
+                    for chunk in chunks]
+        with backends[self.backend](max_workers=self.n_jobs) as executor:
+            return list(executor.map(function, chunks,
+                                     [self.refit_every]*len(chunks),
+                                     [self.warm_start]*len(chunks)))
+
     def __getGarchPredictions(self):
         # !!!!linear model optimized separately from GARCH model!!!!
-        garch_estimates = []
-        true_volatility = []
-        for i in range(len(self.r)-100, len(self.r)-1):
-            r_filtered = self.r[i-200:i]
-            am = arch_model(r_filtered)
-            am = am.fit(disp="off")
-            forecasts = am.forecast(reindex=False)
-            garch_estimates.append(forecasts.mean['h.1'].values[0])
+        # garch_volatility_prediction is the one-step-ahead variance forecast
+        # of every window, estimated on percent returns
+        returns = np.asarray(self.r, dtype=float)
+        scaled = 100*returns
+        ends = range(len(returns)-100, len(returns)-1)
+        if self.engine == "native":
+            windows = rollingWindows(scaled[ends.start-200:ends.stop-1], 200)
+            params = fitGarch(windows[::self.refit_every]).params
+            params = np.repeat(params, self.refit_every, axis=0)[:len(ends)]
+            resid, sigma2 = garchFilter(params, windows)
+            garch_estimates = varianceForecast(params, resid, sigma2)/100**2
+        else:
+            chunks = [scaled[start-200:min(start+self.chunk_size, ends.stop)-1]
+                      for start in ends[::self.chunk_size]]
+            estimates = self.__map(_rollingGarchChunk, chunks)
+            garch_estimates = np.concatenate(estimates)/100**2
 
+        true_volatility = []
+        for i in ends:
             # Get true volatility
-            r_filtered = self.r[i-99:i+1]
+            r_filtered = returns[i-99:i+1]
             true_volatility.append(np.std(r_filtered)**2)
         result = pd.DataFrame(true_volatility, columns=['true_volatility'])
         result.loc[:, 'garch_volatility_prediction'] = garch_estimates
@@ -53,7 +328,26 @@ class Model:
     ################
     # Public methods
     ################
-    def fit(self):
+    def getState(self) -> dict:
+        # Everything needed to forecast without fitting again
+        return dict(params=self.res.params,
+                    linear_correction=(self.intercept, self.garch_vol,
+                                       self.dummy_var),
+                    summary_lr=str(self.summary_lr),
+                    forecasts=dict(self.forecasts),
+                    updates=self.updates)
+
+    def setState(self, state: dict):
+        # Fixing the parameters only filters the data, no optimization
+        self.res = self.arch_model.fix(state['params'])
+        self.__filtered()
+        self.intercept, self.garch_vol, self.dummy_var = \
+            state['linear_correction']
+        self.summary_lr = state['summary_lr']
+        self.forecasts = dict(state['forecasts'])
+        self.updates = state['updates']
+
+    def estimate(self):
         ######
         # !! Linear correction model and ARX + GARCH model are
         # Fitted independently -> suboptimal result!!
@@ -61,6 +355,7 @@ class Model:
 
         # Fit the ARX + GARCH model
         self.res = self.arch_model.fit(disp="off")
+        self.__filtered()
 
         # Fit the linear correction model
         garch_pred = self.__getGarchPredictions()
@@ -79,7 +374,10 @@ class Model:
         self.garch_vol = mod.params['garch_volatility_prediction']
         self.dummy_var = mod.params['dummy']
 
-    def forecast(self, exogenous: int = None):
+    def forecastOne(self, exogenous: list = None) -> tuple:
+        if self.__hasClosedForm():
+            # Same as arch's forecast but includes the updates
+            return super().forecastOne(exogenous)
         if self.ex is None:
             forecasts = self.res.forecast(reindex=False)
             mean = forecasts.mean['h.1'].values[0]
@@ -92,6 +390,109 @@ class Model:
                           self.dummy_var*exogenous[0])
         return mean, vol
 
+    def appendObservations(self, new_returns, new_exog=None):
+        super().appendObservations(new_returns, new_exog)
+        self.arch_model = arch_model(self.r, x=self.ex,
+                                     mean=self.hyperparameters['mean_model'],
+                                     vol=self.hyperparameters['volatility_model'],
+                                     p=self.hyperparameters['p'],
+                                     q=self.hyperparameters['q'])
+
+    def simulationState(self) -> dict:
+        # Parameters and filtered series used by simulation.VaRSimulator
+        # and forecast_many
+        assert self.__hasClosedForm(), \
+            "Only implemented for a GARCH(1,1) volatility model with an " \
+            "ARX (without lags), constant or zero mean"
+        params = self.res.params
+        # arch names the constant Const in ARX and mu in the constant mean
+        const = params.get('Const', params.get('mu', 0.0))
+        if self.ex is None:
+            coef, correction = 0.0, (0.0, 1.0, 0.0)
+        else:
+            # Only the ARX mean has a coefficient of the regressor
+            coef = params.iloc[1] if 'Const' in params else 0.0
+            correction = (self.intercept, self.garch_vol, self.dummy_var)
+        return dict(const=const, coef=coef,
+                    omega=params['omega'], alpha=params['alpha[1]'],
+                    beta=params['beta[1]'], delta=0.0,
+                    correction=correction,
+                    resid=self.resid, sigma2=self.sigma2)
+
     def summary(self):
         print(self.res.summary())
         print(self.summary_lr)
+
+
+class GarchXModel(FilteredModel):
+    def __init__(self, returns: pd.Series,
+                 exogenous_regressor: pd.Series = None,
+                 refit_policy: RefitPolicy = None):
+        # ARX mean and GARCH(1,1) variance in which the exogenous regressor
+        # also scales the variance intercept: omega*exp(delta*x_t). Both
+        # equations are estimated in a single likelihood optimization
+        # (garch.py) so no rolling backtest or correction model is needed.
+        super().__init__(returns, exogenous_regressor,
+                         dict(mean_model="ARX", volatility_model="GARCH-X",
+                              p=1, q=1),
+                         refit_policy)
+
+    ################
+    # Public methods
+    ################
+    def getState(self) -> dict:
+        # Everything needed to forecast without fitting again
+        return dict(params=self.params, resid=self.resid, sigma2=self.sigma2,
+                    loglikelihood=self.loglikelihood,
+                    forecasts=dict(self.forecasts),
+                    in_sample=self.in_sample, updates=self.updates)
+
+    def setState(self, state: dict):
+        self.params = state['params']
+        self.resid = state['resid']
+        self.sigma2 = state['sigma2']
+        self.loglikelihood = state['loglikelihood']
+        self.forecasts = dict(state['forecasts'])
+        self.in_sample = state['in_sample']
+        self.updates = state['updates']
+
+    def estimate(self):
+        # Estimate on percent returns, like arch recommends
+        returns = 100*np.asarray(self.r, dtype=float)
+        if self.ex is None:
+            res = fitGarch(returns)
+            names = ['Const', 'omega', 'alpha[1]', 'beta[1]']
+        else:
+            x = np.asarray(self.ex, dtype=float)
+            res = fitGarch(returns, np.column_stack([np.ones_like(x), x]), x)
+            name = str(getattr(self.ex, 'name', None) or 'x')
+            names = ['Const', name, 'omega', 'alpha[1]', 'beta[1]',
+                     'delta[' + name + ']']
+
+        # Save result for forecast, on the scale of the returns
+        params = res.params[0]
+        k = len(names) - 3 - (self.ex is not None)
+        params[:k] /= 100
+        params[k] /= 100**2
+        self.params = pd.Series(params, index=names)
+        self.resid = res.resid[0]/100
+        self.sigma2 = res.sigma2[0]/100**2
+        self.loglikelihood = res.loglikelihood[0] + len(returns)*np.log(100)
+        self.in_sample = self.loglikelihood/len(returns)
+        self.updates = np.empty(0)
+
+    def simulationState(self) -> dict:
+        # Parameters and filtered series used by simulation.VaRSimulator
+        # and forecast_many
+        params = self.params
+        return dict(const=params['Const'],
+                    coef=params.iloc[1] if self.ex is not None else 0.0,
+                    omega=params['omega'], alpha=params['alpha[1]'],
+                    beta=params['beta[1]'],
+                    delta=params.iloc[-1] if self.ex is not None else 0.0,
+                    correction=(0.0, 1.0, 0.0),
+                    resid=self.resid, sigma2=self.sigma2)
+
+    def summary(self):
+        print(self.params)
+        print("Log-Likelihood: {ll:.2f}".format(ll=self.loglikelihood))
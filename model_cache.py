@@ -0,0 +1,127 @@
+# Atomic file replacement shared by all caches and stores
+from atomic_write import atomicWrite
+
+# Other required packages
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(*series, **hyperparameters) -> str:
+    # Hash of the input series (values and index) and the model settings
+    digest = hashlib.sha256()
+    for s in series:
+        if s is None:
+            digest.update(b"None")
+        else:
+            s = pd.Series(np.asarray(s), index=getattr(s, 'index', None))
+            digest.update(pd.util.hash_pandas_object(s).values.tobytes())
+    digest.update(repr(sorted(hyperparameters.items())).encode())
+    return digest.hexdigest()
+
+
+class ModelCache:
+    def __init__(self, directory: str = "data/model_cache",
+                 max_entries: int = 32, max_files: int = 256,
+                 max_age: int = 3600*24*7):
+        # Two tiers: an in-memory LRU of at most max_entries fitted states
+        # and one pickle per state on disk so results survive restarts.
+        # purge() keeps at most max_files states on disk and deletes those
+        # not written or read from disk for max_age seconds.
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self.max_age = max_age
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    ##################
+    # Helper functions
+    ##################
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pkl")
+
+    def __remember(self, key: str, state: dict):
+        with self.lock:
+            self.memory[key] = state
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    ##################
+    # Public functions
+    ##################
+    def get(self, key: str) -> dict:
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+        try:
+            with open(self.__path(key), 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError,
+                AttributeError, ImportError, IndexError, TypeError):
+            # Missing or unreadable, the next put replaces it
+            self.misses += 1
+            return None
+        try:  # Recently used states are purged last
+            os.utime(self.__path(key))
+        except OSError:
+            pass
+        self.hits += 1
+        self.__remember(key, state)
+        return state
+
+    def put(self, key: str, state: dict):
+        self.__remember(key, state)
+        # Write to a temporary file first so that other workers never read
+        # a half written state
+        with atomicWrite(self.__path(key)) as f:
+            pickle.dump(state, f)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+        if os.path.isdir(self.directory):
+            for file in os.listdir(self.directory):
+                if file.endswith(".pkl"):
+                    os.remove(os.path.join(self.directory, file))
+
+    def purge(self) -> int:
+        # Delete the states on disk that are older than max_age and the
+        # least recently used ones beyond max_files, as well as temporary
+        # files left by writers that died. Returns the number of deleted
+        # files.
+        if not os.path.isdir(self.directory):
+            return 0
+        files = []
+        for file in os.listdir(self.directory):
+            path = os.path.join(self.directory, file)
+            try:
+                files.append((os.stat(path).st_mtime, path))
+            except OSError:  # Removed by another process
+                pass
+        # Newest first, a temporary file older than an hour is abandoned
+        files.sort(reverse=True)
+        now = time.time()
+        states = [path for mtime, path in files if path.endswith(".pkl")]
+        remove = set(states[self.max_files:])
+        remove.update(path for mtime, path in files
+                      if mtime < now - self.max_age or
+                      (path.endswith(".tmp") and mtime < now - 3600))
+        removed = 0
+        for path in remove:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
@@ -5,20 +5,33 @@ import plotly
 import plotly.graph_objs as go
 import plotly.express as px
 
+# Static datasets and the portfolio
+from datasets import registry
+from portfolio_store import portfolios
+from portfolio_import import importer
+
 # Models
-from model import Model
+from model import GarchXModel
+from model_cache import ModelCache
+from refresh import RefreshJob, ResultStore, freshness
+from simulation import VaRSimulator
 from temperature_model import Model as Temperature_model
 from statsmodels.tsa.seasonal import seasonal_decompose
 
 # Utils functions and variables
 from utils import Header, loadTemperatures, months
-from utils import loadDailyReturns, loadHeatwaves
+from utils import loadDailyReturns, loadHeatwaveIndex
 
 # Other required packages
 import pandas as pd
 import numpy as np
+import time
 from datetime import date
 
+# Fitted VaR models, shared by all page loads and kept on disk
+model_cache = ModelCache("data/model_cache")
+# Forecasts published by the background refresher (see refresh.py)
+published = ResultStore("data/published")
 
 ##################
 # HELPER FUNCTIONS
@@ -82,10 +95,10 @@ def formatPredictions(predictions: pd.Series, previous_days: np.ndarray) -> tupl
 
 
 def getCounty(heatwaves: pd.DataFrame) -> tuple:
-    assert len(heatwaves.columns) == 5, \
-        "Dataframe should have a five columns"
-    heatwaves.columns = ['notes', 'county', 'county_code',
-                         'avg_max_temp', 'avg_heat_index']
+    assert "avg_max_temp" in heatwaves.columns, \
+        "Dataframe should have a column named: avg_max_temp"
+    assert "county" in heatwaves.columns, \
+        "Dataframe should have a column named: county"
     maximum = max(heatwaves.avg_max_temp)
     county_largest = (heatwaves[heatwaves.avg_max_temp == maximum]
                       .county.values[0])
@@ -233,9 +246,10 @@ def getSummaryStats(heatwaves: pd.DataFrame) -> tuple:
     return average, maximum, maximum_year
 
 
-def getTemperatureAnomaliesPlot() -> plotly.graph_objs.Figure:
-    df = pd.read_pickle("data/anomalies.pkl")
-    df = df[['time', 'timeMax']]
+def getTemperatureAnomaliesPlot(anomalies: pd.DataFrame) -> plotly.graph_objs.Figure:
+    assert "timeMax" in anomalies.columns, \
+        "Dataframe should have a column named: timeMax"
+    df = anomalies[['time', 'timeMax']].copy()
     df.columns = ['date', 'anomaly_score']
     df.loc[:, "month"] = df.date.apply(lambda x: x.month)
     df_grouped = df.groupby("month", as_index=False).mean()
@@ -264,7 +278,7 @@ def getTemperatureAnomaliesPlot() -> plotly.graph_objs.Figure:
 
 def getTemperatureAnomaliesTSPlot(start_year: int, end_year: int) -> plotly.graph_objs.Figure:
     country = "United States"
-    df = pd.read_pickle("data/anomalies.pkl")
+    df = registry.get("anomalies", copy=True)
     df = df[['time', 'timeMax']]
     df.loc[:, "year"] = df.time.apply(lambda x: x.year)
     df = df[df.year <= end_year]
@@ -303,9 +317,10 @@ def getTemperaturePredictions(df: pd.DataFrame) -> tuple:
     # Go back one year in time to simulate realtime data
     day_of_year = date.today().timetuple().tm_yday
     df = df.head(len(df) - (365 - day_of_year))
-    # Apply temperature model
+    # Apply temperature model, the stored parameters are extended with the
+    # new days and only re-estimated every 30 days
     model = Temperature_model(df)
-    model.fit()
+    model.fit(cache=model_cache)
     previous_temperatures = df.tail(2).DateMax.values
     return model.forecast(), previous_temperatures
 
@@ -345,25 +360,32 @@ def getTemperatureTrendPlot(temperatures: pd.DataFrame) -> plotly.graph_objs.Fig
     return fig
 
 
-def getVaRForecasts(returns: pd.Series, exogenous: pd.Series) -> tuple:
+def getVaRForecasts(returns: pd.Series, exogenous: pd.Series,
+                    session: str) -> tuple:
     try:  # If no portfolio defined, this crashes
         # Get the total portfolio value
-        df_portfolio = pd.read_csv("data/df_portfolio.csv")
+        df_portfolio = portfolios.positions(session)
         total_value = sum(df_portfolio['Value (USD)'])
 
-        # Initiate, fit and forecast using the model.py class
-        model = Model(returns, exogenous_regressor=exogenous)
-        model.fit()
+        # Initiate, fit and forecast using the model.py class, the heatwave
+        # indicator enters both the mean and the variance equation
+        model = GarchXModel(returns, exogenous_regressor=exogenous)
+        model.fit(cache=model_cache)
         mean_0, volatility_0 = model.forecast(exogenous=[0])
         mean_1, volatility_1 = model.forecast(exogenous=[1])
 
+        # One day 99% VaR by filtered historical simulation
+        simulator = VaRSimulator(model)
+        VaR_0 = simulator.simulate(exogenous=0, horizons=[1],
+                                   levels=[0.99]).VaR[0]
+        VaR_1 = simulator.simulate(exogenous=1, horizons=[1],
+                                   levels=[0.99]).VaR[0]
+
         # Formatting the outputs
         VaR_0 = "$" + \
-            "{:,}".format(round(-(mean_0 - 2.326*volatility_0)
-                          * total_value, 2)).replace(',', ' ')
+            "{:,}".format(round(VaR_0*total_value, 2)).replace(',', ' ')
         VaR_1 = "$" + \
-            "{:,}".format(round(-(mean_1 - 2.326*volatility_1)
-                          * total_value, 2)).replace(',', ' ')
+            "{:,}".format(round(VaR_1*total_value, 2)).replace(',', ' ')
         mean_0, mean_1 = round(mean_0*100, 2), round(mean_1*100, 2)
         volatility_0, volatility_1 = round(
             volatility_0*100, 2), round(volatility_1*100, 2)
@@ -372,47 +394,127 @@ def getVaRForecasts(returns: pd.Series, exogenous: pd.Series) -> tuple:
     return VaR_0, VaR_1, mean_0, mean_1, volatility_0, volatility_1
 
 
+def getReturnsWithHeatwaves(session: str) -> pd.DataFrame:
+    daily_returns = loadDailyReturns(session)
+
+    # Flag the trading days that fall in a heatwave
+    heatwaves = loadHeatwaveIndex()
+    daily_returns.loc[:, 'heatwave'] = heatwaves.isHeatwave(
+        daily_returns.Date).astype(int)
+    return daily_returns
+
+
+def computeTemperatureForecast() -> tuple:
+    return getTemperaturePredictions(loadTemperatures())
+
+
+def computeVaRForecasts(session: str) -> tuple:
+    daily_returns = getReturnsWithHeatwaves(session)
+    return getVaRForecasts(daily_returns.daily_returns,
+                           daily_returns.heatwave, session)
+
+
+def getStaticFigures() -> tuple:
+    # Figures that only depend on the static datasets, built once per version
+    # of the data (and before forking the workers, see preload.py)
+    heatwaves_plot = registry.derive("heat_waves_yearly", "plot",
+                                     getHeatwavesPlot)
+    trend_plot = registry.derive("temperatures", "trend_plot",
+                                 getTemperatureTrendPlot)
+    anomalies_plot = registry.derive("anomalies", "monthly_plot",
+                                     getTemperatureAnomaliesPlot)
+    return heatwaves_plot, trend_plot, anomalies_plot
+
+
+def getFreshness(job: RefreshJob, record: dict) -> str:
+    if record is not None and record['inputs'] != job.signature():
+        return freshness(record) + ", updating with the latest data"
+    return freshness(record)
+
+
+##############
+# REFRESH JOBS
+##############
+# The models are fitted in the background and the layout only reads the
+# published forecasts. The temperature forecast moves with the date, the
+# VaR forecasts also follow the portfolio of every session.
+temperature_job = RefreshJob("temperature_forecast", computeTemperatureForecast,
+                             inputs=["data/dfmaxcel.pkl"], every=3600)
+
+
+def getVaRJob(session: str) -> RefreshJob:
+    def compute():
+        return computeVaRForecasts(session)
+
+    def version():
+        return portfolios.version(session)
+    return RefreshJob("var_forecast." + session, compute,
+                      inputs=["data/dfmaxcel.pkl", version], every=3600*24)
+
+
+# Expired sessions and old fitted models are removed at most every
+# `every` seconds per process, the refresher asks for the jobs every poll
+purges: dict = dict(every=3600, last=0.0)
+
+
+def purgeExpired():
+    # The forecasts and import status of deleted sessions are removed and
+    # so are the old fitted models
+    if time.time() - purges['last'] < purges['every']:
+        return
+    purges['last'] = time.time()
+    for session in portfolios.purge():
+        published.discard(getVaRJob(session).name)
+        importer.discard(session)
+    model_cache.purge()
+
+
+def refreshJobs() -> list:
+    # The temperature forecast and the VaR forecasts of the recently seen
+    # sessions
+    purgeExpired()
+    return [temperature_job] + [getVaRJob(session)
+                                for session in portfolios.sessions()]
+
+
 #############################
 # LAYOUT FUNCTION USED BY APP
 #############################
-def create_layout(app):
-    daily_returns = loadDailyReturns().set_index('Date', drop=True)
+def create_layout(app, session: str):
+    daily_returns = getReturnsWithHeatwaves(session)
+    var_job = getVaRJob(session)
 
-    # Link heatwave data to the returns
-    heatwaves = loadHeatwaves()
-    daily_returns = daily_returns.join(heatwaves, how='left')
-    daily_returns.loc[daily_returns['heatwave'].isna(),
-                      'heatwave'] = 0
-    daily_returns = daily_returns.reset_index()
-
-    #  Construct figure and calculate key values
+    #  Construct figure and read the published key values
     error_message_var0, error_message_var1 = "", ""
     stationary_figure = getStationaryFigure(daily_returns)
-    VaR_0, VaR_1, mean_0, mean_1, volatility_0, volatility_1 = getVaRForecasts(
-        daily_returns.daily_returns,
-        daily_returns.heatwave)
+    var_record = published.read(var_job.name)
+    var_freshness = getFreshness(var_job, var_record)
+    if var_record is None:
+        VaR_0, VaR_1, mean_0, mean_1, volatility_0, volatility_1 = "-", "-", "-", "-", "-", "-"
+    else:
+        VaR_0, VaR_1, mean_0, mean_1, volatility_0, volatility_1 = var_record['result']
     if VaR_0 is np.NaN:
         error_message_var0 = "Solution did not convergence. This can happen during live trading, please restart the app and try again."
     if VaR_1 is np.NaN:
         error_message_var1 = "Solution did not convergence. This can happen during live trading, please restart the app and try again."
-    # Download yearly heatwave summary statistics
-    hwy = pd.read_table("data/df_heat_waves_yearly.txt")
-    hwy.columns = ['notes', 'year', 'avg_max_temp', 'avg_heat_index']
+    # Yearly heatwave summary statistics
+    hwy = registry.get("heat_waves_yearly")
     avg_heatwaves, max_heatwaves, max_heatwaves_year = getSummaryStats(hwy)
-    figure = getHeatwavesPlot(hwy)
+    figure, figure_temperature_trend, anomalies_plot = getStaticFigures()
 
-    # Download county heatwave data 2020 and get insights
-    hwc = pd.read_table("data/df_heat_waves_2020.txt")
+    # County heatwave data 2020 and get insights
+    hwc = registry.get("heat_waves_2020")
     county, max_county = getCounty(hwc)
 
-    # Predict heatwaves and construct figures
-    temperatures = loadTemperatures()
-    figure_temperature_trend = getTemperatureTrendPlot(temperatures)
-    predictions, previous_days = getTemperaturePredictions(temperatures)
-    predictions, dates = formatPredictions(predictions, previous_days)
-
-    # Discuss temperature anomalies
-    anomalies_plot = getTemperatureAnomaliesPlot()
+    # Predicted heatwaves
+    temperature_record = published.read(temperature_job.name)
+    temperature_freshness = getFreshness(temperature_job, temperature_record)
+    if temperature_record is None:
+        predictions = [html.Br([]),
+                       html.P("The forecasts are being computed, please refresh the page in a moment.")]
+        dates = []
+    else:
+        predictions, dates = formatPredictions(*temperature_record['result'])
 
     return html.Div(
         [
@@ -621,6 +723,7 @@ def create_layout(app):
                     html.H5("Heat Wave forecasts", style={
                             'font-size': '150%', "text-decoration": "underline"}),
                     html.P("A SARIMAX model is used to forecast the temperature over the next five years. The model is trained using daily temperature data of the last five years. To determine the optimal parameters, the AIC was used."),
+                    html.P(temperature_freshness, style={"color": "#7a7a7a"}),
                     html.Br([]),
                     html.Div(children=[
                         html.Div(children=predictions,
@@ -681,7 +784,8 @@ def create_layout(app):
                             html.Br([]),
                         ]),
 
-                        html.P("The effect of a heatwave on the expected return is estimated by using an ARX-GARCH model with a heatwave indicator variable as an external regressor in the mean model. This ARX-GARCH model also provides an estimate for the volatility, however, this estimate is not influenced by the heatwave indicator variable. A separate linear regression model is trained on historic data to allow the heatwave indicator to correct the volatility estimate. Both models are trained specifically for the portfolio chosen by the user."),
+                        html.P("The effect of a heatwave on the expected return and the volatility is estimated by using an ARX-GARCH-X model with a heatwave indicator variable as an external regressor in both the mean model and the volatility model. Both equations are estimated jointly and the model is trained specifically for the portfolio chosen by the user."),
+                        html.P(var_freshness, style={"color": "#7a7a7a"}),
                         html.Br([]),
 
                         html.Div(
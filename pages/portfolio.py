@@ -5,12 +5,6 @@ import dash_html_components as html
 # Utils functions and variables
 from utils import Header
 
-# Other required packages
-import pandas as pd
-
-df_portfolio = pd.read_csv("data/df_portfolio.csv")
-df_sector_diversification = pd.read_csv("data/df_sector_diversification.csv")
-
 
 def create_layout(app):
     return html.Div(
@@ -119,6 +113,53 @@ def create_layout(app):
                         ],
                         className="rows",
                     ),
+                    # Import a whole portfolio from a file
+                    html.Div(
+                        [
+                            html.Div(
+                                [
+                                    html.P(["Or import many positions at once from a CSV or JSON file with a Ticker and a Number of Shares column."], style={
+                                           "color": "#7a7a7a"})
+                                ],
+                                className="three columns",
+                            ),
+                            html.Div(
+                                [
+                                    dcc.Upload(
+                                        id='upload-portfolio',
+                                        children=html.Div(
+                                            ['Drag and drop or ', html.A('select a file')]),
+                                        accept='.csv,.json',
+                                        max_size=5*1024*1024,
+                                        style={'borderWidth': '1px',
+                                               'borderStyle': 'dashed',
+                                               'borderRadius': '5px',
+                                               'textAlign': 'center',
+                                               'lineHeight': '40px'}
+                                    )
+                                ],
+                                className="six columns",
+                                style={"color": "#696969"},
+                            ),
+                            html.Div(
+                                [
+                                    html.P(
+                                        '',
+                                        id='import-status',
+                                        style={"color": "#7a7a7a"}
+                                    ),
+                                    # Polls the progress of an import
+                                    dcc.Interval(
+                                        id='import-progress',
+                                        interval=1000,
+                                        disabled=True
+                                    )
+                                ],
+                                className="three columns",
+                            ),
+                        ],
+                        className="row ",
+                    ),
                     # Portfolio overview
                     html.Br([]),
                     html.Div(
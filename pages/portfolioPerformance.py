@@ -4,6 +4,10 @@ import dash_html_components as html
 import plotly.graph_objs as go
 import plotly.express as px
 
+# Market data and the portfolio
+from price_cache import prices
+from portfolio_store import portfolios
+
 # Utils functions and variables
 from utils import Header, loadReturns
 from utils import loadColors, loadMetrics, loadDailyReturns
@@ -11,7 +15,6 @@ from utils import loadColors, loadMetrics, loadDailyReturns
 # Other required packages
 import pandas as pd
 import numpy as np
-import yfinance as yf
 
 ##################
 # HELPER FUNCTIONS
@@ -152,17 +155,24 @@ def getStationaryFigure(portfolio_returns: pd.DataFrame) -> dcc.Graph:
 #############################
 # LAYOUT FUNCTION USED BY APP
 #############################
-def create_layout(app):
+def create_layout(app, session: str):
     # Load all necessary information and calculate metrics
-    portfolio_returns = pd.read_csv('data/df_portfolio_returns.csv')
-    index = yf.Ticker('XWD.TO')
-    index_returns = index.history(period='10y')
+    result = portfolios.result(session)
+    portfolio_returns = result['returns']
+    if result['current'] or portfolios.positions(session).empty:
+        status = ""
+    elif result['failed']:
+        status = "Updating the returns of the changed portfolio failed, the returns shown are those of an earlier portfolio. Change the portfolio to try again."
+    else:
+        status = "The portfolio changed, the returns are being updated. Please refresh the page in a moment."
+    index_returns = prices.history(['XWD.TO'], period='10y').rename(
+        columns={'XWD.TO': 'Close'})
     return_1y, return_5y, return_10y, return_1y_i, return_5y_i, return_10y_i = loadReturns(
         portfolio_returns, index_returns)
     color_10, color_5, color_1 = loadColors(return_1y, return_5y, return_10y,
                                             return_1y_i, return_5y_i, return_10y_i)
-    beta, VaR, standev = loadMetrics()
-    daily_returns = loadDailyReturns()
+    beta, VaR, standev = loadMetrics(session)
+    daily_returns = loadDailyReturns(session)
     stationary_figure = getStationaryFigure(daily_returns)
     histogram = getHistogram(daily_returns)
     return html.Div(
@@ -179,6 +189,7 @@ def create_layout(app):
                                     html.H6("Performance",
                                             className="subtitle padded"),
                                     html.P("In order to gauge performance we can compare the returns of the portfolio to the MSCI world index,  a market cap weighted stock market index of 1,585 companies throughout the world."),
+                                    html.P(status, style={"color": "#7a7a7a"}),
                                     dcc.Graph(
                                         id="returns",
                                         figure={
@@ -382,7 +393,7 @@ def create_layout(app):
                             html.Br([]),
                             html.Br([]),
                             html.Br([]),
-                            html.P("VaR 1% (non-parametric)",
+                            html.P("VaR 1% (1 day)",
                                    style={'font-size': '140%'}),
                             html.P(VaR, style={'font-size': '250%'}),
                             html.P("The VaR represents the potential loss in the portfolio given the probability of occurrence for the defined loss.")
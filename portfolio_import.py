@@ -0,0 +1,211 @@
+# Market data
+from metadata_cache import metadata, quotePrice
+
+# Portfolio shared by the callbacks and the pages
+from portfolio_store import portfolios
+
+# Progress of the imports, shared by all processes
+from refresh import ResultStore
+
+# Utils functions and variables
+from utils import stocks
+
+# Other required packages
+import base64
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Accepted column names (lower case) in an uploaded file
+ticker_columns: list = ['ticker', 'symbol']
+shares_columns: list = ['number of shares', 'shares', 'quantity']
+
+max_rows: int = 10000
+max_bytes: int = 5*1024*1024
+
+logger = logging.getLogger(__name__)
+
+
+##################
+# Helper functions
+##################
+def _findColumn(columns: list, accepted: list) -> str:
+    for column in columns:
+        if str(column).strip().lower() in accepted:
+            return column
+    return None
+
+
+def _readUpload(contents: str, filename: str) -> pd.DataFrame:
+    # contents is the data url of dcc.Upload: data:<type>;base64,<data>
+    assert contents and "," in contents, "The upload is empty"
+    data = base64.b64decode(contents.split(",", 1)[1])
+    assert len(data) <= max_bytes, \
+        "The file is larger than {m} MB".format(m=max_bytes//1024//1024)
+    if (filename or "").lower().endswith(".json"):
+        records = json.loads(data.decode("utf-8"))
+        if isinstance(records, dict):  # {"positions": [...]} or {ticker: n}
+            records = records.get("positions", [
+                {'Ticker': ticker, 'Number of Shares': shares}
+                for ticker, shares in records.items()])
+        assert isinstance(records, list), \
+            "The JSON file should hold a list of positions"
+        return pd.DataFrame.from_records(records)
+    return pd.read_csv(io.BytesIO(data), dtype=str, skipinitialspace=True)
+
+
+##################
+# Public functions
+##################
+def parsePositions(contents: str, filename: str) -> tuple:
+    # Tickers and number of shares of an uploaded CSV or JSON file, one row
+    # per ticker (repeated tickers are added up), and a list of the rows
+    # that were left out and why
+    try:
+        df = _readUpload(contents, filename)
+    except (AssertionError, ValueError, UnicodeDecodeError) as e:
+        return pd.DataFrame(columns=['Ticker', 'Number of Shares']), \
+            ["{f} could not be read: {e}".format(f=filename, e=e)]
+    ticker_column = _findColumn(df.columns, ticker_columns)
+    shares_column = _findColumn(df.columns, shares_columns)
+    if ticker_column is None or shares_column is None:
+        return pd.DataFrame(columns=['Ticker', 'Number of Shares']), \
+            ["{f} needs a Ticker and a Number of Shares column".format(
+                f=filename)]
+    if len(df) > max_rows:
+        return pd.DataFrame(columns=['Ticker', 'Number of Shares']), \
+            ["{f} has more than {m} rows".format(f=filename, m=max_rows)]
+
+    # Validate all rows at once, the row numbers are those of the file (a
+    # csv file starts with its header)
+    first_row = 1 if (filename or "").lower().endswith(".json") else 2
+    tickers = df[ticker_column].astype(str).str.strip().str.upper()
+    shares = pd.to_numeric(df[shares_column], errors='coerce')
+    valid_ticker = tickers.str.fullmatch(r"[A-Z0-9.\-^=]{1,15}")
+    valid_shares = np.isfinite(shares) & (shares > 0)
+    errors = ["Row {r}: invalid ticker {t!r}".format(r=row + first_row,
+                                                     t=ticker)
+              for row, ticker in tickers[~valid_ticker].items()]
+    errors += ["Row {r}: invalid number of shares {n!r}".format(
+        r=row + first_row, n=df[shares_column][row])
+        for row in shares[valid_ticker & ~valid_shares].index]
+    positions = pd.DataFrame({'Ticker': tickers, 'Number of Shares': shares})[
+        valid_ticker & valid_shares]
+    positions = positions.groupby('Ticker', as_index=False, sort=False).sum()
+    positions['Number of Shares'] = positions['Number of Shares'].round(2)
+    return positions, errors
+
+
+def importPositions(session: str, positions: pd.DataFrame,
+                    progress=None) -> tuple:
+    # Add the parsed positions to the portfolio of the session: quotes and
+    # details are requested in parallel, one batch of tickers per round of
+    # the provider's workers, and the portfolio is written once. progress
+    # (done, total) is called after every batch. Returns the number of
+    # imported positions and the tickers that were left out.
+    fields = ['bid', 'ask', 'previousClose', 'industry', 'shortName']
+    tickers = list(positions['Ticker'])
+    batch = metadata.provider.max_workers
+    purchases, errors = [], []
+    for start in range(0, len(tickers), batch):
+        infos = metadata.infos(tickers[start:start + batch], fields)
+        for ticker, shares in zip(
+                tickers[start:start + batch],
+                positions['Number of Shares'][start:start + batch]):
+            info = infos.get(ticker)
+            try:
+                price = quotePrice(info)
+            except (TypeError, KeyError):
+                price = None
+            # No bid, ask or previous close gives None or 0
+            if price is None or not np.isfinite(price) or price <= 0:
+                errors.append("{t}: no quote available".format(t=ticker))
+                continue
+            purchases.append(dict(
+                ticker=ticker,
+                name=stocks.get(ticker, info['shortName'] or ticker),
+                shares=float(shares), price=float(price),
+                industry=info['industry'] or "Unknown"))
+        if progress is not None:
+            progress(min(start + batch, len(tickers)), len(tickers))
+    if purchases:
+        portfolios.addPositions(session, purchases)
+    return len(purchases), errors
+
+
+class PositionImporter:
+    def __init__(self, store: ResultStore = None, max_workers: int = 2,
+                 stale: int = 300):
+        # Imports uploaded positions in the background so that the callback
+        # returns at once, the page polls status(). The progress is
+        # published per session to the store, so any process can report it.
+        # An import that made no progress for `stale` seconds (e.g. its
+        # process died) is reported as failed.
+        self.store = ResultStore("data/imports") if store is None else store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.stale = stale
+
+    #################
+    # Private methods
+    #################
+    def __publish(self, session: str, **status):
+        self.store.publish(session, status)
+
+    def __run(self, session: str, positions: pd.DataFrame, filename: str,
+              errors: list):
+        def progress(done: int, total: int):
+            self.__publish(session, filename=filename, done=done, total=total,
+                           finished=False)
+        try:
+            imported, failed = importPositions(session, positions, progress)
+            self.__publish(session, filename=filename, done=len(positions),
+                           total=len(positions), finished=True,
+                           imported=imported, errors=errors + failed)
+        except Exception as e:
+            logger.exception("Importing %s failed", filename)
+            self.__publish(session, filename=filename, done=0,
+                           total=len(positions), finished=True, imported=0,
+                           errors=errors + ["the import failed: {e}".format(
+                               e=e)])
+
+    ################
+    # Public methods
+    ################
+    def status(self, session: str) -> dict:
+        # Latest progress (filename, done, total, finished and when finished
+        # imported and errors) of the import of a session, or None
+        record = self.store.read(session)
+        if record is None:
+            return None
+        status = dict(record['result'])
+        age = (datetime.now() - record['published']).total_seconds()
+        if not status['finished'] and age > self.stale:
+            status.update(finished=True, imported=0,
+                          errors=["the import stopped responding"])
+        return status
+
+    def running(self, session: str) -> bool:
+        status = self.status(session)
+        return status is not None and not status['finished']
+
+    def start(self, session: str, contents: str, filename: str) -> dict:
+        # Parse the upload and import it in the background, returns the
+        # first status
+        positions, errors = parsePositions(contents, filename)
+        self.__publish(session, filename=filename, done=0,
+                       total=len(positions), finished=False)
+        self.executor.submit(self.__run, session, positions, filename, errors)
+        return self.status(session)
+
+    def discard(self, session: str):
+        # Forget the status once it has been shown
+        self.store.discard(session)
+
+
+# Shared by the callbacks
+importer = PositionImporter()
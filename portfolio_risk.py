@@ -0,0 +1,165 @@
+# Models
+from garch import fitGarch
+from model import backends
+from model_cache import ModelCache, fingerprint
+from scipy.optimize import minimize
+from scipy.signal import lfilter
+from scipy.stats import norm
+
+# Other required packages
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _fitTickers(returns: np.ndarray) -> list:
+    # Univariate GARCH(1,1) with constant mean for every row of returns (one
+    # ticker per row), estimated as one batch. Module level function so
+    # that it can be sent to a process pool.
+    res = fitGarch(returns)
+    forecasts = res.forecast()
+    return [dict(params=res.params[i], resid=res.resid[i],
+                 sigma2=res.sigma2[i], variance_forecast=forecasts[i])
+            for i in range(len(returns))]
+
+
+def _dccFilter(a: float, b: float, z: np.ndarray, Q_bar: np.ndarray,
+               chunk: int = 256) -> tuple:
+    # Q_t = (1-a-b) Q_bar + a z_{t-1} z_{t-1}' + b Q_{t-1}, starting from
+    # Q_bar. Returns the negative loglikelihood of the correlations R_t and
+    # the next-day correlation matrix. Only one chunk of Q_t is kept in
+    # memory: the recursion is a linear filter over every element of Q and
+    # the determinants and quadratic forms of a chunk are computed at once.
+    T, N = z.shape
+    intercept = (1 - a - b)*Q_bar
+    nll, Q_previous = 0.0, None
+    for start in range(0, T + 1, chunk):
+        stop = min(start + chunk, T + 1)
+        first = max(start, 1)
+        z_lag = z[first-1:stop-1]
+        x = intercept + a*z_lag[:, :, None]*z_lag[:, None, :]
+        if start == 0:
+            x = np.concatenate([Q_bar[None], x])
+            initial = np.zeros((1, N*N))
+        else:
+            initial = b*Q_previous.reshape(1, N*N)
+        Q = lfilter([1], [1, -b], x.reshape(-1, N*N), axis=0,
+                    zi=initial)[0].reshape(-1, N, N)
+        Q_previous = Q[-1]
+        scale = 1/np.sqrt(np.diagonal(Q, axis1=1, axis2=2))
+        R = Q*scale[:, :, None]*scale[:, None, :]
+        # The last R (t = T) is the forecast, it has no observation
+        n = min(stop, T) - start
+        if n > 0:
+            _, logdet = np.linalg.slogdet(R[:n])
+            z_chunk = z[start:start + n]
+            quadratic = np.einsum('ti,ti->t', z_chunk, np.linalg.solve(
+                R[:n], z_chunk[:, :, None])[:, :, 0])
+            nll += 0.5*np.sum(logdet + quadratic - np.sum(z_chunk**2, axis=1))
+    return nll, R[-1]
+
+
+def _dccNegativeLoglikelihood(ab: np.ndarray, z: np.ndarray,
+                              Q_bar: np.ndarray) -> float:
+    return _dccFilter(ab[0], ab[1], z, Q_bar)[0]
+
+
+class PortfolioRisk:
+    def __init__(self, returns: pd.DataFrame, backend: str = "thread",
+                 n_jobs: int = None, cache: ModelCache = None):
+        # Multivariate risk model for a portfolio: a GARCH(1,1) per ticker
+        # (one column of returns per ticker, fitted in parallel and cached
+        # per ticker) combined through a DCC(1,1) correlation layer. Once
+        # fitted, VaR for any set of weights only needs matrix algebra.
+        assert backend == "serial" or backend in backends, \
+            "backend should be one of: serial, thread, process"
+        # Correlations need a common calendar
+        self.returns = returns.dropna()
+        self.tickers = list(self.returns.columns)
+        self.backend = backend
+        self.n_jobs = n_jobs
+        self.cache = cache
+
+    #################
+    # Private methods
+    #################
+    def __fitTickers(self) -> list:
+        keys = self.__keys()
+        fits = [None if self.cache is None else self.cache.get(key)
+                for key in keys]
+        missing = [i for i, fit in enumerate(fits) if fit is None]
+        # The tickers share one calendar so they are estimated in batches,
+        # one batch per worker
+        series = self.returns[[self.tickers[i] for i in missing]].values.T
+        if not missing:
+            results = []
+        elif self.backend == "serial":
+            results = _fitTickers(series)
+        else:
+            batches = np.array_split(
+                series, min(len(missing), self.n_jobs or os.cpu_count()))
+            with backends[self.backend](max_workers=self.n_jobs) as executor:
+                results = [fit for batch in executor.map(_fitTickers, batches)
+                           for fit in batch]
+        for i, result in zip(missing, results):
+            fits[i] = result
+            if self.cache is not None:
+                self.cache.put(keys[i], result)
+        return fits
+
+    def __keys(self) -> list:
+        return [fingerprint(self.returns[ticker], model="GARCH(1,1)")
+                for ticker in self.tickers]
+
+    def __weights(self, weights) -> np.ndarray:
+        # Weights are an array in ticker order or a dict/Series by ticker
+        if isinstance(weights, (dict, pd.Series)):
+            weights = [weights.get(ticker, 0.0) for ticker in self.tickers]
+        weights = np.asarray(weights, dtype=float)
+        assert len(weights) == len(self.tickers), \
+            "Provide one weight per ticker"
+        return weights
+
+    ################
+    # Public methods
+    ################
+    def fit(self):
+        fits = self.__fitTickers()
+        self.mean = np.array([fit['params'][0] for fit in fits])
+        self.variance = np.array([fit['variance_forecast'] for fit in fits])
+
+        # DCC(1,1) on the standardized residuals
+        z = np.column_stack([fit['resid']/np.sqrt(fit['sigma2'])
+                             for fit in fits])
+        Q_bar = np.atleast_2d(np.corrcoef(z, rowvar=False))
+        key = fingerprint(None, tickers=self.__keys(), model="DCC(1,1)")
+        dcc = None if self.cache is None else self.cache.get(key)
+        if dcc is None:
+            res = minimize(_dccNegativeLoglikelihood, x0=[0.02, 0.95],
+                           args=(z, Q_bar), method="SLSQP",
+                           bounds=[(0, 1), (0, 1)],
+                           constraints=[{'type': 'ineq',
+                                         'fun': lambda ab: 0.9999 - sum(ab)}])
+            if not res.success:
+                raise RuntimeError("DCC estimation failed: {m}".format(
+                    m=res.message))
+            dcc = dict(a=res.x[0], b=res.x[1])
+            if self.cache is not None:
+                self.cache.put(key, dcc)
+        self.a, self.b = dcc['a'], dcc['b']
+        _, self.correlation = _dccFilter(self.a, self.b, z, Q_bar)
+
+        # Next-day covariance matrix of the returns
+        volatility = np.sqrt(self.variance)
+        self.covariance = self.correlation*np.outer(volatility, volatility)
+
+    def portfolioVolatility(self, weights) -> float:
+        w = self.__weights(weights)
+        return np.sqrt(w @ self.covariance @ w)
+
+    def VaR(self, weights, level: float = 0.99) -> float:
+        # Parametric next-day VaR, in the unit of the weights: fractions
+        # give a relative VaR, position values (USD) a VaR in dollars
+        w = self.__weights(weights)
+        return -(w @ self.mean - norm.ppf(level)*self.portfolioVolatility(w))
@@ -0,0 +1,400 @@
+# Other required packages
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Positions with running totals
+from ledger import PositionLedger
+
+# Portfolio table columns and the names used by the pages
+position_columns: dict = {'Ticker': 'ticker',
+                          'Name': 'name',
+                          'Number of Shares': 'shares',
+                          'Price': 'price',
+                          'Value (USD)': 'value',
+                          'Industry': 'industry'}
+
+# Bumped when the tables change, older tables are dropped
+schema_version: int = 2
+schema: str = """
+CREATE TABLE IF NOT EXISTS positions (session TEXT, ticker TEXT, name TEXT,
+    shares REAL, price REAL, value REAL, industry TEXT,
+    PRIMARY KEY (session, ticker));
+CREATE TABLE IF NOT EXISTS returns (session TEXT, date TEXT, value REAL,
+    PRIMARY KEY (session, date));
+CREATE TABLE IF NOT EXISTS metrics (session TEXT, name TEXT, value REAL,
+    PRIMARY KEY (session, name));
+CREATE TABLE IF NOT EXISTS versions (session TEXT, name TEXT, version TEXT,
+    PRIMARY KEY (session, name));
+CREATE TABLE IF NOT EXISTS sessions (session TEXT PRIMARY KEY, seen REAL);
+"""
+
+tables: list = ['positions', 'returns', 'metrics']
+
+# Numpy numbers from the dataframes are stored as plain numbers
+for _type in [np.int8, np.int16, np.int32, np.int64]:
+    sqlite3.register_adapter(_type, int)
+sqlite3.register_adapter(np.float32, float)
+
+
+def newSession() -> str:
+    return uuid.uuid4().hex
+
+
+class PortfolioStore:
+    def __init__(self, path: str = "data/portfolio.db", timeout: float = 30,
+                 max_sessions: int = 256, idle: int = 1800,
+                 max_age: int = 3600*24*7):
+        # The portfolio of every session (see newSession), its value history
+        # and its metrics in one SQLite database (WAL mode: readers never
+        # wait for a writer) shared by all workers. Every process keeps the
+        # tables of at most max_sessions recently used sessions in memory,
+        # sessions idle for `idle` seconds are dropped from memory and read
+        # from disk again when they come back. Sessions unseen for max_age
+        # seconds are deleted (purge). A write goes to the database and the
+        # memory at once. Every write stores a new random version of the
+        # table, the memory copy is read again when the version in the
+        # database differs (another process wrote).
+        self.path = path
+        self.timeout = timeout
+        self.max_sessions = max_sessions
+        self.idle = idle
+        self.max_age = max_age
+        self.local = threading.local()
+        self.memory = OrderedDict()  # session -> tables, used and touched
+        self.lock = threading.Lock()
+
+    #################
+    # Private methods
+    #################
+    def __connection(self) -> sqlite3.Connection:
+        # One connection per thread, opened again in a forked worker
+        if getattr(self.local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("BEGIN IMMEDIATE")
+            if connection.execute("PRAGMA user_version").fetchone()[0] \
+                    != schema_version:
+                for table in tables + ['versions', 'sessions']:
+                    connection.execute("DROP TABLE IF EXISTS " + table)
+                connection.execute(
+                    "PRAGMA user_version = {v}".format(v=schema_version))
+            for statement in schema.split(";"):
+                connection.execute(statement)
+            connection.execute("COMMIT")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+            self.local.depth = 0
+        return self.local.connection
+
+    def __entry(self, session: str) -> dict:
+        # Memory of a session, the least recently used and idle sessions are
+        # dropped (they stay on disk)
+        assert isinstance(session, str) and re.fullmatch("[0-9a-f]{32}",
+                                                         session), \
+            "Provide a session id created by newSession"
+        now = time.time()
+        with self.lock:
+            entry = self.memory.pop(session, None) or dict(tables={},
+                                                          touched=0)
+            entry['used'] = now
+            self.memory[session] = entry
+            while len(self.memory) > self.max_sessions or \
+                    now - next(iter(self.memory.values()))['used'] > self.idle:
+                self.memory.popitem(last=False)
+            touch = now - entry['touched'] > 60
+            if touch:
+                entry['touched'] = now
+        if touch:  # Last seen, at most once a minute
+            self.__connection().execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?)",
+                (session, now))
+        return entry
+
+    def __versions(self, session: str) -> dict:
+        rows = self.__connection().execute(
+            "SELECT name, version FROM versions WHERE session = ?",
+            (session,)).fetchall()
+        return dict(rows)
+
+    def __cached(self, session: str, table: str, read):
+        entry = self.__entry(session)
+        version = self.__versions(session).get(table)
+        cached = entry['tables'].get(table)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        frame = read(self.__connection(), session)
+        entry['tables'][table] = (version, frame)
+        return frame
+
+    def __written(self, session: str, table: str, frame):
+        # A random version: a rolled back write can never match a later one
+        version = uuid.uuid4().hex
+        self.__connection().execute(
+            "INSERT OR REPLACE INTO versions VALUES (?, ?, ?)",
+            (session, table, version))
+        self.__entry(session)['tables'][table] = (version, frame)
+
+    ##################
+    # Helper functions
+    ##################
+    def __readPositions(self, connection: sqlite3.Connection,
+                        session: str) -> PositionLedger:
+        positions = pd.read_sql_query(
+            "SELECT {c} FROM positions WHERE session = ? ORDER BY rowid"
+            .format(c=", ".join(position_columns.values())), connection,
+            params=(session,))
+        return PositionLedger.fromFrame(positions.rename(
+            columns={v: k for k, v in position_columns.items()}))
+
+    def __readReturns(self, connection: sqlite3.Connection,
+                      session: str) -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT date AS Date, value AS Return FROM returns "
+            "WHERE session = ? ORDER BY date", connection, params=(session,))
+
+    def __readMetrics(self, connection: sqlite3.Connection,
+                      session: str) -> pd.Series:
+        rows = connection.execute(
+            "SELECT name, value FROM metrics WHERE session = ?",
+            (session,)).fetchall()
+        return pd.Series({name: np.nan if value is None else value
+                          for name, value in rows}, dtype=float)
+
+    ################
+    # Public methods
+    ################
+    @contextmanager
+    def transaction(self):
+        # Reads and writes inside the block are one atomic unit, other
+        # writers wait until it is committed, e.g.
+        # with portfolios.transaction():
+        #     positions = portfolios.positions(session)
+        #     portfolios.savePositions(session, ...)
+        connection = self.__connection()
+        if self.local.depth > 0:  # Nested, part of the outer transaction
+            self.local.depth += 1
+            try:
+                yield
+            finally:
+                self.local.depth -= 1
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        self.local.depth = 1
+        try:
+            yield
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            self.local.depth = 0
+
+    def version(self, session: str) -> tuple:
+        # Versions of all tables of a session, changes with every write
+        versions = self.__versions(session)
+        return tuple(versions.get(table) for table in tables)
+
+    def ledger(self, session: str) -> PositionLedger:
+        # Positions with the running totals, shared: change it with
+        # addPosition only
+        return self.__cached(session, 'positions', self.__readPositions)
+
+    def positionsVersion(self, session: str) -> str:
+        return self.__versions(session).get('positions')
+
+    def isCurrent(self, session: str) -> bool:
+        # Whether the returns and metrics were computed from the current
+        # positions
+        versions = self.__versions(session)
+        return versions.get('result') == versions.get('positions')
+
+    def publishResult(self, session: str, positions_version: str,
+                      value: pd.Series, metrics: dict) -> bool:
+        # Returns and metrics computed from a version of the positions, both
+        # are written together and only when the positions did not change in
+        # the meantime. Returns whether they were written.
+        with self.transaction():
+            if self.__versions(session).get('positions') != \
+                    positions_version:
+                return False
+            self.saveReturns(session, value)
+            self.saveMetrics(session, metrics)
+            self.__connection().execute(
+                "INSERT OR REPLACE INTO versions VALUES (?, 'result', ?)",
+                (session, positions_version))
+        return True
+
+    def publishFailure(self, session: str, positions_version: str):
+        # Computing the result of a version of the positions failed for good
+        self.__connection().execute(
+            "INSERT OR REPLACE INTO versions VALUES (?, 'failed', ?)",
+            (session, positions_version))
+
+    def result(self, session: str) -> dict:
+        # The latest published returns and metrics, read together: read
+        # again when a new result was published in between. version is the
+        # version of the positions they were computed from, current
+        # whether those are still the current positions and failed whether
+        # computing the result of the current positions failed.
+        keys = ['returns', 'metrics', 'result']
+        while True:
+            versions = self.__versions(session)
+            returns, metrics = self.returns(session), self.metrics(session)
+            latest = self.__versions(session)
+            if all(versions.get(key) == latest.get(key) for key in keys):
+                break
+        current = latest.get('result') == latest.get('positions')
+        return dict(returns=returns, metrics=metrics,
+                    version=latest.get('result'), current=current,
+                    failed=not current and
+                    latest.get('failed') == latest.get('positions'))
+
+    def positions(self, session: str) -> pd.DataFrame:
+        # Ticker, Name, Number of Shares, Price, Value (USD) and Industry,
+        # shared: callers must not modify it
+        return self.ledger(session).frame()
+
+    def sectors(self, session: str) -> pd.DataFrame:
+        # Industry, Total Value and Relative Value of the positions
+        return self.ledger(session).sectors()
+
+    def addPosition(self, session: str, ticker: str, name: str,
+                    shares: float, price: float, industry: str) -> dict:
+        # Add shares to one position, only that position is written
+        return self.addPositions(session, [dict(
+            ticker=ticker, name=name, shares=shares, price=price,
+            industry=industry)])[ticker]
+
+    def addPositions(self, session: str, purchases: list) -> dict:
+        # Add many purchases (dicts with ticker, name, shares, price and
+        # industry) in one transaction, only the touched positions are
+        # written. Returns the updated positions by ticker.
+        with self.transaction():
+            # The shared ledger only changes when the change is stored: the
+            # purchases go to a copy that replaces it in the memory
+            ledger = self.ledger(session).copy()
+            positions = {}
+            for purchase in purchases:
+                positions[purchase['ticker']] = ledger.add(
+                    purchase['ticker'], purchase['name'], purchase['shares'],
+                    purchase['price'], purchase['industry'])
+            self.__connection().executemany(
+                "INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (session, ticker) DO UPDATE SET "
+                "shares = excluded.shares, value = excluded.value",
+                [[session] + [position[column] for column in position_columns]
+                 for position in positions.values()])
+            # A transaction that is rolled back after this leaves the memory
+            # with a version that is not in the database, it is then read
+            # again
+            self.__written(session, 'positions', ledger)
+        return positions
+
+    def savePositions(self, session: str, positions: pd.DataFrame):
+        # Replace all positions
+        ledger = PositionLedger.fromFrame(positions)
+        with self.transaction():
+            connection = self.__connection()
+            connection.execute("DELETE FROM positions WHERE session = ?",
+                               (session,))
+            connection.executemany(
+                "INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [[session] + [position[column] for column in position_columns]
+                 for position in ledger.positions.values()])
+            self.__written(session, 'positions', ledger)
+
+    def returns(self, session: str) -> pd.DataFrame:
+        # Date and Return (value of the portfolio) columns, a copy
+        return self.__cached(session, 'returns', self.__readReturns).copy()
+
+    def saveReturns(self, session: str, value: pd.Series):
+        # Value of the portfolio per day
+        returns = pd.DataFrame({'Date': np.datetime_as_string(
+            pd.DatetimeIndex(value.index).values, unit='D'),
+            'Return': value.values.astype(float)})
+        with self.transaction():
+            connection = self.__connection()
+            connection.execute("DELETE FROM returns WHERE session = ?",
+                               (session,))
+            connection.executemany(
+                "INSERT INTO returns VALUES (?, ?, ?)",
+                zip([session]*len(returns), returns['Date'].tolist(),
+                    returns['Return'].tolist()))
+            self.__written(session, 'returns', returns)
+
+    def metrics(self, session: str) -> pd.Series:
+        # e.g. beta and the ESG scores of the portfolio
+        return self.__cached(session, 'metrics', self.__readMetrics)
+
+    def saveMetrics(self, session: str, metrics: dict):
+        metrics = pd.Series(metrics, dtype=float)
+        with self.transaction():
+            connection = self.__connection()
+            connection.execute("DELETE FROM metrics WHERE session = ?",
+                               (session,))
+            connection.executemany(
+                "INSERT INTO metrics VALUES (?, ?, ?)",
+                [(session, name, None if np.isnan(value) else float(value))
+                 for name, value in metrics.items()])
+            self.__written(session, 'metrics', metrics)
+
+    def clear(self, session: str):
+        # Empty portfolio
+        with self.transaction():
+            self.savePositions(session,
+                               pd.DataFrame(columns=list(position_columns)))
+            self.saveReturns(session, pd.Series(
+                dtype=float, index=pd.DatetimeIndex([])))
+            self.saveMetrics(session, {})
+
+    def sessions(self, idle: int = 3600*24) -> list:
+        # Sessions with a portfolio that were seen in the last idle seconds
+        rows = self.__connection().execute(
+            "SELECT session FROM sessions WHERE seen >= ? AND EXISTS "
+            "(SELECT 1 FROM positions WHERE positions.session = "
+            "sessions.session) ORDER BY seen DESC",
+            (time.time() - idle,)).fetchall()
+        return [session for session, in rows]
+
+    def purge(self) -> list:
+        # Delete the sessions that were not seen for max_age seconds
+        with self.transaction():
+            connection = self.__connection()
+            expired = [session for session, in connection.execute(
+                "SELECT session FROM sessions WHERE seen < ?",
+                (time.time() - self.max_age,)).fetchall()]
+            for table in tables + ['versions', 'sessions']:
+                connection.executemany(
+                    "DELETE FROM {t} WHERE session = ?".format(t=table),
+                    [(session,) for session in expired])
+        with self.lock:
+            for session in expired:
+                self.memory.pop(session, None)
+        return expired
+
+    def memoryUsage(self) -> dict:
+        # Sessions and bytes of the tables kept in memory
+        with self.lock:
+            frames = [frame.frame() if isinstance(frame, PositionLedger)
+                      else frame for entry in self.memory.values()
+                      for _, frame in entry['tables'].values()]
+            sessions = len(self.memory)
+        return dict(sessions=sessions,
+                    bytes=int(sum(np.sum(frame.memory_usage(deep=True))
+                                  for frame in frames)))
+
+
+# Shared by the app, the pages and the refresh worker
+portfolios = PortfolioStore()
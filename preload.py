@@ -0,0 +1,28 @@
+# Heavy imports, loaded once in the gunicorn master and shared by the
+# workers (see gunicorn.conf.py)
+import arch  # noqa: F401
+import plotly.express  # noqa: F401
+import statsmodels.api  # noqa: F401
+
+# Static datasets and figures
+from datasets import registry
+from pages.heatWaves import getStaticFigures
+from utils import loadHeatwaveIndex
+
+# Other required packages
+import gc
+
+
+def warmUp():
+    # Load everything the pages need that does not depend on the user
+    registry.loadAll()
+    loadHeatwaveIndex()
+    getStaticFigures()
+
+
+def freeze():
+    # Move all objects created so far to a permanent generation, the
+    # garbage collector then no longer writes to their headers and the
+    # forked workers keep sharing those pages
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,130 @@
+# Market data
+from market_data import MarketDataProvider, getProvider
+
+# Atomic file replacement shared by all caches and stores
+from atomic_write import atomicWrite
+
+# Other required packages
+import os
+import threading
+import time
+from collections import OrderedDict
+from zipfile import BadZipFile
+
+import numpy as np
+import pandas as pd
+
+
+class PriceCache:
+    def __init__(self, provider: MarketDataProvider,
+                 directory: str = "data/price_cache", max_entries: int = 64,
+                 max_age: int = 3600*6, seeds: dict = {}):
+        # Daily closes per ticker in two tiers: an in-memory LRU and one .npz
+        # file (Date and Close columns) per ticker on disk. Once a ticker is
+        # cached only the days after its last cached day are downloaded, at
+        # most once every max_age seconds. seeds maps a ticker to a csv file
+        # (Date and Close columns) with its history, used when the ticker is
+        # not cached yet.
+        self.provider = provider
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.seeds = seeds
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+    ##################
+    # Helper functions
+    ##################
+    def __path(self, ticker: str) -> str:
+        return os.path.join(self.directory, ticker + ".npz")
+
+    def __remember(self, ticker: str, entry: dict):
+        with self.lock:
+            self.memory[ticker] = entry
+            self.memory.move_to_end(ticker)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def __read(self, ticker: str) -> dict:
+        with self.lock:
+            if ticker in self.memory:
+                self.memory.move_to_end(ticker)
+                return self.memory[ticker]
+        entry = None
+        try:
+            with np.load(self.__path(ticker)) as data:
+                entry = dict(closes=pd.Series(
+                    data['Close'], index=pd.to_datetime(data['Date'])),
+                    fetched=float(data['fetched']))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, EOFError, BadZipFile):
+            # An unreadable file is a miss, it is replaced by the next write
+            pass
+        if entry is None and ticker in self.seeds:
+            closes = pd.read_csv(self.seeds[ticker], index_col='Date',
+                                 parse_dates=True)['Close']
+            entry = dict(closes=closes, fetched=0.0)
+        if entry is not None:
+            self.__remember(ticker, entry)
+        return entry
+
+    def __write(self, ticker: str, closes: pd.Series):
+        # Only completed trading days are cached, the price of today can
+        # still change
+        closes = closes.dropna()
+        closes = closes[closes.index < pd.Timestamp.today().normalize()]
+        entry = dict(closes=closes, fetched=time.time())
+        self.__remember(ticker, entry)
+        with atomicWrite(self.__path(ticker)) as f:
+            np.savez(f, Date=closes.index.values.astype('datetime64[ns]'),
+                     Close=closes.values, fetched=entry['fetched'])
+
+    def __merge(self, cached: pd.Series, tail: pd.Series) -> pd.Series:
+        # Append the new days. Adjusted closes change when a dividend or
+        # split happens, the whole cached history is then rescaled with the
+        # change of the last cached day instead of downloaded again.
+        tail = tail.dropna()
+        last = cached.index[-1]
+        if last in tail.index and \
+                not np.isclose(tail[last], cached.iloc[-1], rtol=1e-4):
+            cached = cached*(tail[last]/cached.iloc[-1])
+        return pd.concat([cached, tail[tail.index > last]])
+
+    ################
+    # Public methods
+    ################
+    def history(self, tickers: list, period: str = "10y") -> pd.DataFrame:
+        # Daily closes of the last period, one column per ticker
+        assert period.endswith("y"), "Period should be in years, e.g. 10y"
+        tickers = list(dict.fromkeys(tickers))
+        entries = {ticker: self.__read(ticker) for ticker in tickers}
+        missing = [ticker for ticker in tickers if entries[ticker] is None]
+        stale = [ticker for ticker in tickers if entries[ticker] is not None
+                 and time.time() - entries[ticker]['fetched'] > self.max_age]
+
+        # Full history for new tickers, one batched request
+        if missing:
+            closes = self.provider.closes(missing, period=period)
+            for ticker in missing:
+                self.__write(ticker, closes[ticker])
+        # Only the missing tail for the others, one batched request from the
+        # oldest last cached day on
+        if stale:
+            start = min(entries[ticker]['closes'].index[-1]
+                        for ticker in stale)
+            tail = self.provider.closes(stale, start=start)
+            for ticker in stale:
+                self.__write(ticker, self.__merge(entries[ticker]['closes'],
+                                                  tail[ticker]))
+
+        closes = pd.concat([self.__read(ticker)['closes'].rename(ticker)
+                            for ticker in tickers], axis=1)
+        start = closes.index.max() - pd.DateOffset(years=int(period[:-1]))
+        return closes[closes.index >= start].rename_axis('Date')
+
+
+# Shared by the app and the pages, the world index history is in the repo
+prices = PriceCache(getProvider(),
+                    seeds={"XWD.TO": "data/df_world_index.csv"})
@@ -0,0 +1,149 @@
+# Other required packages
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:  # Only available on unix, elsewhere runs are only serialized per process
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class RecomputeCoordinator:
+    def __init__(self, pipeline, debounce: float = 1.0, max_workers: int = 4,
+                 directory: str = "data/recompute", retries: int = 3,
+                 backoff: float = 5.0, on_failure=None):
+        # Runs pipeline(key, cancelled) in the background after a request for
+        # a key (e.g. a session). Requests within `debounce` seconds of each
+        # other start a single run, at most one run per key is in flight
+        # (also across processes, with a lock file per key in directory) and
+        # a request during a run supersedes it: cancelled() then returns
+        # True, the pipeline should stop without publishing and the key is
+        # run again. pipeline returns whether it published a result.
+        # A run that raises is retried up to `retries` times, after backoff,
+        # 2*backoff, ... seconds, then on_failure(key) is called.
+        self.pipeline = pipeline
+        self.debounce = debounce
+        self.directory = directory
+        self.retries = retries
+        self.backoff = backoff
+        self.on_failure = on_failure
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.states = {}  # key -> generation, timer, running and attempts
+        self.lock = threading.Lock()
+        # Runs that did not publish were superseded or already up to date
+        self.counts = dict(requests=0, runs=0, published=0, skipped=0,
+                           failed=0, retried=0, gave_up=0)
+
+    #################
+    # Private methods
+    #################
+    def __claim(self, key: str):
+        # Blocking exclusive lock, waits for a run of another process
+        os.makedirs(self.directory, exist_ok=True)
+        f = open(os.path.join(self.directory, key + ".lock"), 'w')
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def __start(self, key: str, generation: int):
+        # The debounce timer of a request ran out, unless a newer request
+        # (with its own timer) came in
+        with self.lock:
+            state = self.states.get(key)
+            if state is None or state['generation'] != generation:
+                return
+            state['timer'] = None
+            if state['running']:  # The running one runs again when done
+                return
+            state['running'] = True
+        self.executor.submit(self.__run, key)
+
+    def __run(self, key: str):
+        gave_up = False
+        lock = self.__claim(key)
+        try:
+            while True:
+                with self.lock:
+                    state = self.states[key]
+                    generation = state['generation']
+                    self.counts['runs'] += 1
+
+                def cancelled() -> bool:
+                    return state['generation'] != generation
+                failed = False
+                try:
+                    published = self.pipeline(key, cancelled)
+                    with self.lock:
+                        self.counts['published' if published
+                                    else 'skipped'] += 1
+                except Exception:
+                    failed = True
+                    with self.lock:
+                        self.counts['failed'] += 1
+                    logger.exception("Recomputing %s failed", key)
+                with self.lock:
+                    if failed and state['generation'] == generation:
+                        if state['attempts'] < self.retries:
+                            # The timer runs the same generation again,
+                            # unless a new request replaces it
+                            state['attempts'] += 1
+                            self.counts['retried'] += 1
+                            state['timer'] = threading.Timer(
+                                self.backoff*2**(state['attempts'] - 1),
+                                self.__start, [key, generation])
+                            state['timer'].daemon = True
+                            state['timer'].start()
+                        else:
+                            self.counts['gave_up'] += 1
+                            gave_up = True
+                    # Done when nothing was requested during the run or when
+                    # the new request (or retry) still waits for its timer
+                    # (which starts the next run)
+                    if state['generation'] == generation or \
+                            state['timer'] is not None:
+                        state['running'] = False
+                        if state['timer'] is None:
+                            del self.states[key]
+                        break
+        finally:
+            lock.close()
+        if gave_up and self.on_failure is not None:
+            try:
+                self.on_failure(key)
+            except Exception:
+                logger.exception("Reporting the failure of %s failed", key)
+
+    ################
+    # Public methods
+    ################
+    def request(self, key: str) -> int:
+        # Recompute key, returns the generation of the request
+        assert re.fullmatch(r"[\w.-]+", key), "Invalid key: {k}".format(k=key)
+        with self.lock:
+            state = self.states.setdefault(
+                key, dict(generation=0, timer=None, running=False,
+                          attempts=0))
+            state['generation'] += 1
+            state['attempts'] = 0
+            self.counts['requests'] += 1
+            if state['timer'] is not None:
+                state['timer'].cancel()
+            state['timer'] = threading.Timer(self.debounce, self.__start,
+                                             [key, state['generation']])
+            state['timer'].daemon = True
+            state['timer'].start()
+            return state['generation']
+
+    def pending(self, key: str) -> bool:
+        # Whether a run of key is waiting or in flight in this process
+        with self.lock:
+            return key in self.states
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counts, active=len(self.states))
@@ -0,0 +1,211 @@
+# Atomic file replacement shared by all caches and stores
+from atomic_write import atomicWrite
+
+# Other required packages
+import logging
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+
+try:  # Only available on unix, elsewhere every refresher computes
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshJob:
+    def __init__(self, name: str, compute, inputs: list = [],
+                 every: int = 3600):
+        # A model result that is recomputed by compute() every `every`
+        # seconds or as soon as one of the inputs changes. An input is a
+        # file or a function that returns the version of the data, e.g.
+        # PortfolioStore.version
+        self.name = name
+        self.compute = compute
+        self.inputs = inputs
+        self.every = every
+
+    def signature(self) -> tuple:
+        # Modification time and size of the input files
+        signature = []
+        for path in self.inputs:
+            if callable(path):
+                signature.append((path.__qualname__, path()))
+                continue
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+
+class ResultStore:
+    def __init__(self, directory: str = "data/published"):
+        # One pickle per published result, shared by all processes. Readers
+        # keep the last read result and only unpickle again when the file
+        # has been replaced.
+        self.directory = directory
+        self.memory = {}
+        self.lock = threading.Lock()
+
+    ##################
+    # Helper functions
+    ##################
+    def __path(self, name: str) -> str:
+        return os.path.join(self.directory, name + ".pkl")
+
+    ##################
+    # Public functions
+    ##################
+    def publish(self, name: str, result, inputs: tuple = ()):
+        record = dict(result=result, inputs=inputs,
+                      published=datetime.now())
+        # Atomic replace, readers see either the old or the new result
+        with atomicWrite(self.__path(name)) as f:
+            pickle.dump(record, f)
+
+    def read(self, name: str) -> dict:
+        # Latest published record (result, inputs, published) or None
+        try:
+            mtime = os.stat(self.__path(name)).st_mtime_ns
+        except OSError:
+            return None
+        with self.lock:
+            if name in self.memory and self.memory[name][0] == mtime:
+                return self.memory[name][1]
+        try:
+            with open(self.__path(name), 'rb') as f:
+                record = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        with self.lock:
+            self.memory[name] = (mtime, record)
+        return record
+
+    def discard(self, name: str):
+        # Remove a result that is no longer needed
+        for path in [self.__path(name), self.__path(name) + ".lock"]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self.lock:
+            self.memory.pop(name, None)
+
+    def claim(self, name: str):
+        # Non-blocking exclusive lock so that only one process (e.g. one of
+        # the gunicorn workers) recomputes a result, None when it is taken
+        os.makedirs(self.directory, exist_ok=True)
+        f = open(self.__path(name) + ".lock", 'w')
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return None
+        return f
+
+
+class ModelRefresher:
+    def __init__(self, jobs, store: ResultStore = None,
+                 poll: int = 10):
+        # Recomputes the jobs in the background and publishes their results
+        # to the store, either in a daemon thread (start) or in the current
+        # process (run, used by the separate worker: python refresh.py).
+        # jobs is a list or a function that returns the current jobs.
+        self.jobs = jobs
+        self.store = ResultStore() if store is None else store
+        self.poll = poll
+        self.stopped = threading.Event()
+        self.thread = None
+        # Failed jobs are retried when their inputs change or after `every`
+        self.failures = {}
+
+    #################
+    # Private methods
+    #################
+    def __isDue(self, job: RefreshJob, signature: tuple) -> bool:
+        if job.name in self.failures:
+            failed_signature, failed_at = self.failures[job.name]
+            if failed_signature == signature and \
+                    time.time() - failed_at < job.every:
+                return False
+        record = self.store.read(job.name)
+        if record is None or record['inputs'] != signature:
+            return True
+        age = (datetime.now() - record['published']).total_seconds()
+        return age >= job.every
+
+    def __refresh(self, job: RefreshJob):
+        signature = job.signature()
+        if not self.__isDue(job, signature):
+            return
+        lock = self.store.claim(job.name)
+        if lock is None:  # Another process is computing this result
+            return
+        try:
+            # Read again, the other process may have just published
+            if self.__isDue(job, signature):
+                start = time.time()
+                self.store.publish(job.name, job.compute(), signature)
+                self.failures.pop(job.name, None)
+                logger.info("Published %s in %.1fs", job.name,
+                            time.time() - start)
+        except Exception:
+            self.failures[job.name] = (signature, time.time())
+            logger.exception("Refreshing %s failed", job.name)
+        finally:
+            lock.close()
+
+    ################
+    # Public methods
+    ################
+    def refreshAll(self):
+        for job in self.jobs() if callable(self.jobs) else self.jobs:
+            self.__refresh(job)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.refreshAll()
+            self.stopped.wait(self.poll)
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name="model-refresher")
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+
+def freshness(record: dict) -> str:
+    # Human readable age of a published result
+    if record is None:
+        return "Not computed yet"
+    minutes = int((datetime.now() - record['published']).total_seconds()//60)
+    if minutes < 1:
+        age = "less than a minute ago"
+    elif minutes < 60:
+        age = "{m} minutes ago".format(m=minutes)
+    else:
+        age = "{h} hours ago".format(h=minutes//60)
+    return "Last updated {t} ({age})".format(
+        t=record['published'].strftime("%d %B, %Y %H:%M"), age=age)
+
+
+if __name__ == "__main__":
+    # Separate worker process, run the web app with MODEL_REFRESH=process
+    # so that it does not start its own refresh thread. Only on a host
+    # where both share the data directory (data/published and
+    # data/portfolio.db), e.g. not as a separate Heroku dyno.
+    logging.basicConfig(level=logging.INFO)
+    from pages.heatWaves import refreshJobs, published
+    ModelRefresher(refreshJobs, published).run()
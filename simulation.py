@@ -0,0 +1,86 @@
+# Other required packages
+import numpy as np
+import pandas as pd
+
+
+class VaRSimulator:
+    def __init__(self, model, method: str = "bootstrap",
+                 seed: int = 123456):
+        # Monte Carlo engine on top of a fitted model.Model or
+        # model.GarchXModel (ARX mean + GARCH(1,1) variance).
+        # Innovations are either bootstrapped from the standardized
+        # residuals (filtered historical simulation) or drawn from a normal
+        assert method in ["bootstrap", "normal"], \
+            "method should be one of: bootstrap, normal"
+        state = model.simulationState()
+        self.method = method
+        self.seed = seed
+        self.const, self.coef = state['const'], state['coef']
+        self.omega, self.delta = state['omega'], state['delta']
+        self.alpha, self.beta = state['alpha'], state['beta']
+        self.correction = state['correction']
+        resid, sigma2 = state['resid'], state['sigma2']
+        std_resid = resid/np.sqrt(sigma2)
+        self.std_resid = std_resid[np.isfinite(std_resid)]
+        # Last residual and variance to start the simulation from
+        self.resid, self.sigma2 = resid[-1], sigma2[-1]
+
+    ##################
+    # Helper functions
+    ##################
+    def __innovations(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        if self.method == "bootstrap":
+            return self.std_resid[rng.integers(0, len(self.std_resid), n)]
+        return rng.standard_normal(n)
+
+    def __variance(self, sigma2: np.ndarray, exogenous: float) -> np.ndarray:
+        # Apply the linear heatwave correction of model.Model to the GARCH
+        # variance (the identity for models without correction)
+        intercept, slope, dummy = self.correction
+        corrected = intercept + slope*sigma2 + dummy*exogenous
+        return np.maximum(corrected, 1e-12)
+
+    ##################
+    # Public functions
+    ##################
+    def simulatePaths(self, exogenous: float = 0, horizons: list = [1, 5, 10],
+                      n_paths: int = 100000,
+                      chunk_size: int = 20000) -> np.ndarray:
+        # Cumulative returns (n_paths x horizons) of paths in which the
+        # exogenous regressor stays at the given value. Paths are simulated
+        # in chunks and only the requested horizons are kept, so the working
+        # memory is bounded by chunk_size.
+        rng = np.random.default_rng(self.seed)
+        mean = self.const + self.coef*exogenous
+        omega = self.omega*np.exp(self.delta*exogenous)
+        cumulative = np.empty((n_paths, len(horizons)))
+        columns = {h: i for i, h in enumerate(horizons)}
+        for start in range(0, n_paths, chunk_size):
+            n = min(chunk_size, n_paths - start)
+            sigma2 = np.full(n, omega + self.alpha*self.resid**2 +
+                             self.beta*self.sigma2)
+            total = np.zeros(n)
+            for h in range(1, max(horizons) + 1):
+                eps = np.sqrt(self.__variance(sigma2, exogenous)) * \
+                    self.__innovations(rng, n)
+                total += mean + eps
+                if h in columns:
+                    cumulative[start:start+n, columns[h]] = total
+                sigma2 = omega + self.alpha*eps**2 + self.beta*sigma2
+        return cumulative
+
+    def simulate(self, exogenous: float = 0, horizons: list = [1, 5, 10],
+                 levels: list = [0.95, 0.99], n_paths: int = 100000,
+                 chunk_size: int = 20000) -> pd.DataFrame:
+        # Value at Risk and Expected Shortfall (as positive fractions of the
+        # portfolio value) for every horizon (in days) and confidence level
+        paths = self.simulatePaths(exogenous, horizons, n_paths, chunk_size)
+        result = []
+        for i, h in enumerate(horizons):
+            returns = paths[:, i]
+            for level in levels:
+                VaR = -np.quantile(returns, 1 - level)
+                ES = -np.mean(returns[returns <= -VaR])
+                result.append({'horizon': h, 'level': level,
+                               'VaR': VaR, 'ES': ES})
+        return pd.DataFrame(result)
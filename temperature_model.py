@@ -1,5 +1,6 @@
 # Models
 import statsmodels.api as sm
+from model_cache import ModelCache, fingerprint
 
 # Other required packages
 import pandas as pd
@@ -10,19 +11,94 @@ warnings.filterwarnings("ignore")
 
 
 class Model:
-    def __init__(self, temperatures: pd.Series):
-        self.temperatures = temperatures
+    def __init__(self, temperatures: pd.Series, refit_every: int = 30):
+        # A daily DatetimeIndex lets statsmodels extend the results with
+        # new days, missing days become NaN which the Kalman filter skips
+        temperatures = temperatures.copy()
+        temperatures.index = pd.to_datetime(temperatures.index)
+        self.temperatures = temperatures.asfreq('D')
         # Parameters of the model have been determined based
         # on the AIC
-        self.model = sm.tsa.statespace.SARIMAX(temperatures,
-                                               order=(0, 0, 3),
-                                               seasonal_order=(0, 1, 3, 12),
+        self.order = (0, 0, 3)
+        self.seasonal_order = (0, 1, 3, 12)
+        self.model = sm.tsa.statespace.SARIMAX(self.temperatures,
+                                               order=self.order,
+                                               seasonal_order=self.seasonal_order,
                                                enforce_stationarity=False,
                                                enforce_invertibility=False)
+        # Days of new data after which the parameters are estimated again
+        self.refit_every = refit_every
         self.fitted_model = None
 
-    def fit(self):
-        self.fitted_model = self.model.fit(disp=False)
+    #################
+    # Private methods
+    #################
+    def __needsRefit(self, state: dict) -> bool:
+        if state is None:
+            return True
+        end = self.temperatures.index[-1]
+        return abs((end - state['fitted']).days) >= self.refit_every or \
+            self.__revised(state)
+
+    def __revised(self, state: dict) -> bool:
+        # Whether the days up to the stored end changed since the state was
+        # stored, compared on the days both windows contain (the window may
+        # have moved on)
+        stored = state.get('observations')
+        if stored is None:
+            return True
+        current = self.temperatures.loc[:state['end']]
+        start = max(current.index[0], stored.index[0])
+        return not current.loc[start:].equals(stored.loc[start:])
+
+    def __extend(self, state: dict):
+        # Run the Kalman filter with the stored parameters over the days
+        # since the stored state only, instead of over the whole window.
+        # A window that does not contain the stored day is filtered fully.
+        if state['end'] not in self.temperatures.index:
+            return self.model.filter(state['params'])
+        model = self.model.clone(self.temperatures.loc[state['end']:])
+        model.ssm.initialize_known(state['state'], state['state_cov'])
+        return model.filter(state['params'])
+
+    def __state(self, fitted) -> dict:
+        # One-step-ahead prediction of the state for the last day, so that
+        # the next extension always starts with at least one observation
+        return dict(params=self.fitted_model.params,
+                    state=self.fitted_model.predicted_state[:, -2],
+                    state_cov=self.fitted_model.predicted_state_cov[:, :, -2],
+                    end=self.temperatures.index[-1],
+                    observations=self.temperatures,
+                    fitted=fitted)
+
+    ################
+    # Public methods
+    ################
+    def fingerprint(self) -> str:
+        return fingerprint(None, model="SARIMAX", order=self.order,
+                           seasonal_order=self.seasonal_order,
+                           columns=list(self.temperatures.columns))
+
+    def fit(self, cache: ModelCache = None):
+        # Without a cache the parameters are estimated on the full window.
+        # With a cache, the stored parameters and filtered state are
+        # extended with the new days and a full estimation (started from
+        # the stored parameters) only runs every refit_every days.
+        if cache is None:
+            self.fitted_model = self.model.fit(disp=False)
+            return self
+        key = self.fingerprint()
+        state = cache.get(key)
+        if not self.__needsRefit(state):
+            self.fitted_model = self.__extend(state)
+            if state['end'] != self.temperatures.index[-1]:
+                cache.put(key, self.__state(state['fitted']))
+            return self
+        start_params = None if state is None else state['params']
+        self.fitted_model = self.model.fit(start_params=start_params,
+                                           disp=False)
+        cache.put(key, self.__state(self.temperatures.index[-1]))
+        return self
 
     def diagnostics(self):
         assert self.fitted_model is not None, \
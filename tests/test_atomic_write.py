@@ -0,0 +1,54 @@
+# Other required packages
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from atomic_write import atomicWrite  # noqa: E402
+from model_cache import ModelCache  # noqa: E402
+
+
+def test_threads_write_the_same_path(tmp_path):
+    # Every writer has its own temporary file, the last one wins whole
+    cache = ModelCache(str(tmp_path))
+    errors = []
+
+    def write(i: int):
+        try:
+            for _ in range(50):
+                cache.put("key", dict(values=np.full(1000, i)))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert os.listdir(tmp_path) == ["key.pkl"]
+    values = ModelCache(str(tmp_path)).get("key")['values']
+    assert len(set(values)) == 1
+
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    path = str(tmp_path/"file")
+    with atomicWrite(path) as f:
+        f.write(b"old")
+    try:
+        with atomicWrite(path) as f:
+            f.write(b"new")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert os.listdir(tmp_path) == ["file"]
+    with open(path, 'rb') as f:
+        assert f.read() == b"old"
+
+
+def test_unreadable_state_is_a_miss(tmp_path):
+    with open(tmp_path/"key.pkl", 'wb') as f:
+        f.write(b"\x80\x04 truncated")
+    assert ModelCache(str(tmp_path)).get("key") is None
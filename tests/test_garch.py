@@ -0,0 +1,46 @@
+# Models
+from arch import arch_model
+
+# Other required packages
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from garch import fitGarch, rollingWindows  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def returns() -> np.ndarray:
+    # Daily returns of the MSCI world index, in percent
+    close = pd.read_csv(os.path.join(os.path.dirname(__file__), os.pardir,
+                                     "data", "df_world_index.csv")).Close
+    return 100*close.pct_change().dropna().values
+
+
+def test_fit_matches_arch(returns):
+    # Same estimates and loglikelihood as arch's constant mean GARCH(1,1)
+    res = arch_model(returns).fit(disp="off")
+    fit = fitGarch(returns)
+    np.testing.assert_allclose(fit.params[0], res.params.values, rtol=1e-4,
+                               atol=1e-6)
+    np.testing.assert_allclose(fit.loglikelihood[0], res.loglikelihood,
+                               rtol=1e-6)
+    np.testing.assert_allclose(
+        fit.forecast()[0],
+        res.forecast(reindex=False).variance['h.1'].values[0], rtol=1e-4)
+
+
+def test_batch_matches_arch(returns):
+    # Every window of a batch is estimated as arch would estimate it alone
+    windows = rollingWindows(returns[-300:], 200)[::20]
+    fit = fitGarch(windows)
+    for window, forecast in zip(windows, fit.forecast()):
+        res = arch_model(window).fit(disp="off")
+        np.testing.assert_allclose(
+            forecast, res.forecast(reindex=False).variance['h.1'].values[0],
+            rtol=2e-4)
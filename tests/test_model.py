@@ -0,0 +1,76 @@
+# Models
+from arch import arch_model
+
+# Other required packages
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import GarchXModel, Model, RefitPolicy  # noqa: E402
+from model_cache import ModelCache  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def returns() -> pd.Series:
+    rng = np.random.default_rng(0)
+    return pd.Series(rng.standard_t(5, 1000), name='Return')
+
+
+@pytest.mark.parametrize("mean_model", ["ARX", "Constant", "Zero"])
+def test_forecast_matches_arch(returns, mean_model):
+    # The closed-form forecast of a GARCH(1,1) without updates is arch's
+    model = Model(returns, None, mean_model=mean_model)
+    model.fit()
+    mean, vol = model.forecast()
+    expected = model.res.forecast(reindex=False)
+    assert np.isclose(mean, expected.mean['h.1'].values[0])
+    assert np.isclose(vol, np.sqrt(expected.variance['h.1'].values[0]))
+
+
+def test_forecast_without_closed_form(returns):
+    # Other means are forecast by arch
+    model = Model(returns, None, mean_model="HAR")
+    model.fit()
+    mean, vol = model.forecast()
+    assert np.isfinite(mean) and np.isfinite(vol) and vol > 0
+
+
+@pytest.mark.parametrize("model_class", [Model, GarchXModel])
+def test_update_is_cached(tmp_path, returns, model_class):
+    # Both models absorb new observations and store them in the cache, a
+    # model fitted on the extended data restores the updated state
+    exogenous = pd.Series((np.arange(len(returns)) % 7 == 0).astype(float),
+                          name='Heatwave')
+    policy = RefitPolicy(every=None, drift=np.inf)
+    cache = ModelCache(directory=str(tmp_path))
+    model = model_class(returns[:990], exogenous[:990], refit_policy=policy)
+    model.fit(cache=cache)
+    assert not model.update(returns[990:], exogenous[990:])
+    assert len(model.updates) == 10
+    updated = model.forecast(exogenous=[1])
+    restored = model_class(returns, exogenous, refit_policy=policy)
+    restored.fit(cache=cache)
+    assert len(restored.updates) == 10
+    assert np.allclose(restored.forecast(exogenous=[1]), updated)
+
+
+def test_correction_regressor_is_variance_forecast():
+    # The correction regresses the true variance on the one-step-ahead
+    # variance forecasts of arch fitted on every 200 day window (in percent)
+    close = pd.read_csv(os.path.join(os.path.dirname(__file__), os.pardir,
+                                     "data", "df_world_index.csv")).Close
+    returns = close.pct_change().dropna().reset_index(drop=True)
+    model = Model(returns, None)
+    predictions = model._Model__getGarchPredictions()
+    expected = []
+    for i in range(len(returns) - 100, len(returns) - 1):
+        res = arch_model(100*returns[i-200:i]).fit(disp="off")
+        expected.append(
+            res.forecast(reindex=False).variance['h.1'].values[0]/100**2)
+    np.testing.assert_allclose(
+        predictions['garch_volatility_prediction'], expected, rtol=1e-3)
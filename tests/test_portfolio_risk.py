@@ -0,0 +1,41 @@
+# Other required packages
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from portfolio_risk import PortfolioRisk, _dccFilter  # noqa: E402
+
+
+def test_dcc_filter_matches_recursion():
+    # Chunked filter against the recursion written out for every day
+    rng = np.random.default_rng(0)
+    z = rng.standard_normal((600, 4))
+    Q_bar = np.corrcoef(z, rowvar=False)
+    a, b = 0.03, 0.9
+    Q, nll = Q_bar, 0.0
+    for t in range(len(z) + 1):
+        if t > 0:
+            Q = (1 - a - b)*Q_bar + a*np.outer(z[t-1], z[t-1]) + b*Q
+        scale = 1/np.sqrt(np.diag(Q))
+        R = Q*np.outer(scale, scale)
+        if t < len(z):
+            nll += 0.5*(np.linalg.slogdet(R)[1] +
+                        z[t] @ np.linalg.solve(R, z[t]) - z[t] @ z[t])
+    result, forecast = _dccFilter(a, b, z, Q_bar, chunk=64)
+    assert np.isclose(result, nll)
+    np.testing.assert_allclose(forecast, R)
+
+
+def test_duplicate_tickers_raise():
+    # Identical returns have no correlation model, the caller falls back
+    rng = np.random.default_rng(1)
+    returns = rng.standard_normal(500)*0.01
+    frame = pd.DataFrame({'A': returns, 'B': returns,
+                          'C': rng.standard_normal(500)*0.01})
+    with pytest.raises(np.linalg.LinAlgError):
+        PortfolioRisk(frame, backend="serial").fit()
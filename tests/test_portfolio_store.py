@@ -0,0 +1,63 @@
+# Other required packages
+import multiprocessing
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from portfolio_store import PortfolioStore, newSession  # noqa: E402
+
+
+def addPositions(path: str, session: str, worker: int):
+    # Every worker buys its own ticker and a ticker shared by all workers
+    store = PortfolioStore(path)
+    for _ in range(25):
+        store.addPosition(session, 'W{w}'.format(w=worker), 'Worker', 1,
+                          10.0, 'Industry {i}'.format(i=worker % 2))
+        store.addPosition(session, 'SHARED', 'Shared', 1, 10.0, 'Shared')
+
+
+def test_processes_add_positions(tmp_path):
+    # The read-modify-write of addPosition is one transaction, concurrent
+    # workers lose no purchase
+    path = str(tmp_path / "portfolio.db")
+    session = newSession()
+    store = PortfolioStore(path)
+    store.addPosition(session, 'SHARED', 'Shared', 1, 10.0, 'Shared')
+    workers = [multiprocessing.Process(target=addPositions,
+                                       args=(path, session, w))
+               for w in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(worker.exitcode == 0 for worker in workers)
+    # Read from disk by a new store and through the memory of the first one
+    for reader in [PortfolioStore(path), store]:
+        positions = reader.positions(session).set_index('Ticker')
+        assert positions.loc['SHARED', 'Number of Shares'] == 101
+        for w in range(4):
+            assert positions.loc['W{w}'.format(w=w), 'Number of Shares'] == 25
+        sectors = reader.sectors(session).set_index('Industry')
+        assert sectors.loc['Shared', 'Total Value'] == 1010
+        assert sectors.loc['Industry 0', 'Total Value'] == 500
+
+
+def test_outdated_result_is_not_published(tmp_path):
+    # A result computed from positions that changed since is rejected
+    store = PortfolioStore(str(tmp_path / "portfolio.db"))
+    session = newSession()
+    store.addPosition(session, 'A', 'A', 1, 10.0, 'Industry')
+    version = store.positionsVersion(session)
+    store.addPosition(session, 'A', 'A', 1, 10.0, 'Industry')
+    value = pd.Series([10.0, 11.0],
+                      index=pd.to_datetime(['2021-01-04', '2021-01-05']))
+    assert not store.publishResult(session, version, value, {'beta': 1.0})
+    assert store.result(session)['version'] is None
+    version = store.positionsVersion(session)
+    assert store.publishResult(session, version, value, {'beta': 1.0})
+    result = store.result(session)
+    assert result['current'] and result['version'] == version
+    assert result['metrics']['beta'] == 1.0
@@ -0,0 +1,130 @@
+# Other required packages
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recompute import RecomputeCoordinator  # noqa: E402
+
+
+class FakePipeline:
+    def __init__(self, duration: float = 0.5, failures: int = 0):
+        # Takes `duration` seconds, checks cancelled() every 50 ms and
+        # raises on the first `failures` calls
+        self.duration = duration
+        self.failures = failures
+        self.runs = []  # (key, outcome)
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, key: str, cancelled) -> bool:
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if self.failures > 0:
+                self.failures -= 1
+                self.runs.append((key, 'failed'))
+                raise RuntimeError("Fake failure")
+            start = time.time()
+            while time.time() - start < self.duration:
+                time.sleep(0.05)
+                if cancelled():
+                    self.runs.append((key, 'cancelled'))
+                    return False
+            self.runs.append((key, 'published'))
+            return True
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def wait(coordinator: RecomputeCoordinator, key: str, timeout: float = 10):
+    start = time.time()
+    while coordinator.pending(key):
+        assert time.time() - start < timeout, "Recompute did not finish"
+        time.sleep(0.05)
+
+
+def test_requests_are_debounced(tmp_path):
+    # A burst of requests within the debounce starts a single run
+    pipeline = FakePipeline()
+    coordinator = RecomputeCoordinator(pipeline, debounce=0.2,
+                                       directory=str(tmp_path))
+    for _ in range(10):
+        coordinator.request('session')
+        time.sleep(0.02)
+    wait(coordinator, 'session')
+    assert pipeline.runs == [('session', 'published')]
+    stats = coordinator.stats()
+    assert stats['requests'] == 10 and stats['runs'] == 1
+    assert stats['active'] == 0
+
+
+def test_request_during_run_supersedes_it(tmp_path):
+    # The running generation is cancelled and the key is run again, never
+    # two runs of a key at once
+    pipeline = FakePipeline()
+    coordinator = RecomputeCoordinator(pipeline, debounce=0.1,
+                                       directory=str(tmp_path))
+    first = coordinator.request('session')
+    time.sleep(0.3)
+    second = coordinator.request('session')
+    assert second == first + 1
+    wait(coordinator, 'session')
+    assert pipeline.runs == [('session', 'cancelled'),
+                             ('session', 'published')]
+    assert pipeline.max_active == 1
+    stats = coordinator.stats()
+    assert stats['published'] == 1 and stats['skipped'] == 1
+
+
+def test_lock_file_serializes_coordinators(tmp_path):
+    # Coordinators of different workers share the lock directory, a key is
+    # never run by two of them at once
+    pipeline = FakePipeline(duration=0.3)
+    coordinators = [RecomputeCoordinator(pipeline, debounce=0.05,
+                                         directory=str(tmp_path))
+                    for _ in range(2)]
+    for coordinator in coordinators:
+        coordinator.request('session')
+    for coordinator in coordinators:
+        wait(coordinator, 'session')
+    assert pipeline.runs == [('session', 'published')]*2
+    assert pipeline.max_active == 1
+
+
+def test_keys_run_independently(tmp_path):
+    pipeline = FakePipeline(duration=0.2)
+    coordinator = RecomputeCoordinator(pipeline, debounce=0.05,
+                                       directory=str(tmp_path))
+    for key in ['a', 'b', 'c']:
+        coordinator.request(key)
+    for key in ['a', 'b', 'c']:
+        wait(coordinator, key)
+    assert sorted(pipeline.runs) == [('a', 'published'), ('b', 'published'),
+                                     ('c', 'published')]
+
+
+def test_failed_runs_are_retried(tmp_path):
+    # A failing run is retried after the backoff, on_failure is called once
+    # all retries failed
+    given_up = []
+    pipeline = FakePipeline(duration=0.05, failures=2)
+    coordinator = RecomputeCoordinator(pipeline, debounce=0.05, retries=3,
+                                       backoff=0.05, directory=str(tmp_path),
+                                       on_failure=given_up.append)
+    coordinator.request('session')
+    wait(coordinator, 'session')
+    assert [outcome for _, outcome in pipeline.runs] == \
+        ['failed', 'failed', 'published']
+    assert given_up == []
+    pipeline.failures = 10
+    coordinator.request('session')
+    wait(coordinator, 'session')
+    assert given_up == ['session']
+    stats = coordinator.stats()
+    assert stats['retried'] == 5 and stats['gave_up'] == 1
@@ -0,0 +1,41 @@
+# Other required packages
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_cache import ModelCache  # noqa: E402
+from temperature_model import Model  # noqa: E402
+
+
+def temperatures(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2015-01-01", periods=n, freq='D')
+    seasonal = 25 + 8*np.sin(2*np.pi*np.arange(n)/365)
+    return pd.DataFrame({'DateMax': seasonal + rng.normal(0, 2, n)},
+                        index=days)
+
+
+def fittedDay(df: pd.DataFrame, cache: ModelCache) -> pd.Timestamp:
+    # The stored state records the day of its last full estimation
+    Model(df).fit(cache=cache)
+    return cache.get(Model(df).fingerprint())['fitted']
+
+
+def test_new_days_extend_the_stored_state(tmp_path):
+    cache = ModelCache(str(tmp_path))
+    df = temperatures(400)
+    fitted = fittedDay(df.head(390), cache)
+    assert fittedDay(df, cache) == fitted
+
+
+def test_revised_days_refit(tmp_path):
+    cache = ModelCache(str(tmp_path))
+    df = temperatures(400)
+    fitted = fittedDay(df.head(390), cache)
+    revised = df.copy()
+    revised.iloc[100, 0] += 5
+    assert fittedDay(revised, cache) == revised.index[-1] != fitted
@@ -2,7 +2,17 @@
 import dash_html_components as html
 import dash_core_components as dcc
 
+# Heatwave detection
+from heatwaves import HeatwaveIndex
+
+# Portfolio shared by the callbacks and the pages
+from portfolio_store import portfolios
+
+# Atomic file replacement shared by all caches and stores
+from atomic_write import atomicWrite
+
 # Other required packages
+import os
 import pandas as pd
 import numpy as np
 import requests
@@ -31,22 +41,6 @@ plotly_colors: list = ['rgb(4,67,123)', 'rgb(84,189,236)', 'rgb(215,224,234)',
                        'rgb(52,140,196)', 'rgb(221, 138, 46)', 'rgb(156,196,44)', 'rgb(208,200,64)']
 
 
-def createEmptyDatasets():
-    # Creating an empty portfolio, diversification and returns dataframe
-    # TODO: allow uploading a CSV file with tickers and number of shares
-    df_portfolio = pd.DataFrame(
-        columns=['Ticker', 'Name', 'Number of Shares', 'Price', 'Value (USD)', 'Industry'])
-    df_portfolio.to_csv('data/df_portfolio.csv', index=False)
-
-    df_diversification = pd.DataFrame(
-        columns=['Industry', 'Total Value', 'Relative Value'])
-    df_diversification.to_csv(
-        'data/df_sector_diversification.csv', index=False)
-
-    df_returns = pd.DataFrame(columns=['Date', 'Return'])
-    df_returns.to_csv('data/df_portfolio_returns.csv', index=False)
-
-
 def get_header(app):
     header = html.Div(
         [
@@ -135,9 +129,9 @@ def loadColors(return_1y: float, return_5y: float, return_10y: float,
     return color_10, color_5, color_1
 
 
-def loadDailyReturns() -> pd.DataFrame:
-    # Get returns
-    portfolio_returns = pd.read_csv('data/df_portfolio_returns.csv')
+def loadDailyReturns(session: str) -> pd.DataFrame:
+    # Get the latest published returns
+    portfolio_returns = portfolios.result(session)['returns']
     # Switched to daily returns
     daily_returns = portfolio_returns.Return.pct_change().dropna()
     portfolio_returns = portfolio_returns.iloc[1:]
@@ -145,50 +139,38 @@ def loadDailyReturns() -> pd.DataFrame:
     return portfolio_returns
 
 
-def loadHeatwaves() -> pd.Series:
-    temperatures = loadTemperatures().dropna().tail(365*11)
-    temperatures.DateMax = temperatures.DateMax
-    temps = temperatures.DateMax
-    heatwave = []
-    h = False
-    min_temp = 32.2
-    for i in range(len(temps) - 2):
-        temp_tod = temps[i]
-        temp_tom = temps[i+1]
-        temp_ove = temps[i+1]
-        if h and temp_tod > min_temp:
-            heatwave.append(1)
-        elif temp_tod > min_temp and temp_tom > min_temp and temp_ove > min_temp:
-            heatwave.append(1)
-            h = True
-        else:
-            heatwave.append(0)
-            h = False
-    heatwave.append(0)
-    heatwave.append(0)
-    temperatures.loc[:, 'heatwave'] = heatwave
-    return temperatures['heatwave']
-
-
-def loadMetrics() -> tuple:
-    # Load the portfolio returns
-    portfolio_returns = pd.read_csv('data/df_portfolio_returns.csv')
-    df_portfolio = pd.read_csv("data/df_portfolio.csv")
+def loadHeatwaveIndex(path: str = "data/heatwave_index.npz") -> HeatwaveIndex:
+    # Heatwave intervals of the full temperature history, built once and
+    # built again when the temperature data changes
+    source = "data/dfmaxcel.pkl"
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source):
+        return HeatwaveIndex.load(path)
+    index = HeatwaveIndex.fromTemperatures(loadTemperatures().DateMax)
+    index.save(path)
+    return index
+
+
+def loadMetrics(session: str) -> tuple:
+    # Load the latest published portfolio returns and metrics
+    result = portfolios.result(session)
+    portfolio_returns = result['returns']
+    df_portfolio = portfolios.positions(session)
     beta, VaR, standev = "-", "-", "-"
     if portfolio_returns.shape[0] > 0:  # if stocks in portfolio
         # Get the beta
-        f = open('data/beta.txt', 'r')
-        beta = str(round(float(f.readline()), 4))
-        f.close()
+        beta = str(round(result['metrics']['beta'], 4))
 
         # Get the daily returns and portfolio value
         daily_returns = portfolio_returns.Return.pct_change().dropna()
         total_value = sum(df_portfolio['Value (USD)'])
 
-        # Calculate non-parametric VaR and standard deviation
-        VaR = "$" + \
-            "{:,}".format(
-                round(-np.percentile(daily_returns, 1) * total_value, 2))
+        # GARCH-DCC VaR of the published result, results published before
+        # it was computed fall back to the non-parametric VaR
+        VaR = result['metrics'].get('VaR', np.nan)
+        if np.isnan(VaR):
+            VaR = -np.percentile(daily_returns, 1) * total_value
+        VaR = "$" + "{:,}".format(round(VaR, 2))
+        # Standard deviation of the daily returns
         standev = str(round(np.std(daily_returns) * 100, 2)) + "%"
     return beta, VaR, standev
 
@@ -234,10 +216,34 @@ def loadReturns(portfolio_returns: pd.Series, index_returns: pd.Series) -> tuple
     return return_1y, return_5y, return_10y, return_1y_i, return_5y_i, return_10y_i
 
 
-def loadTemperatures() -> pd.DataFrame:
+def buildTemperatureStore(directory: str = "data/temperature_store"):
+    # Columnar copy of dfmaxcel.pkl: one .npy file per column with the
+    # calibration already applied, so that loading is a memory map instead
+    # of unpickling and the pages are shared by all workers
     df = pd.read_pickle("data/dfmaxcel.pkl")
-    df.DateMax = df.DateMax - (45-32.2)  # Calibrate temperatures
-    return df
+    columns = {'Date': pd.to_datetime(df.index).values.astype('datetime64[ns]'),
+               'DateMax': (df.DateMax - (45-32.2)).values.astype(float)}  # Calibrate temperatures
+    for name, values in columns.items():
+        path = os.path.join(directory, name + ".npy")
+        with atomicWrite(path) as f:
+            np.save(f, values)
+
+
+def loadTemperatures(directory: str = "data/temperature_store") -> pd.DataFrame:
+    dates_path = os.path.join(directory, "Date.npy")
+    values_path = os.path.join(directory, "DateMax.npy")
+    if not os.path.exists(values_path) or \
+            os.path.getmtime(values_path) < os.path.getmtime("data/dfmaxcel.pkl"):
+        buildTemperatureStore(directory)
+    dates = np.load(dates_path, mmap_mode='r')
+    values = np.load(values_path, mmap_mode='r')
+    if len(dates) != len(values):  # Another worker is building the store
+        buildTemperatureStore(directory)
+        return loadTemperatures(directory)
+    # Both columns stay backed by the memory mapped files
+    return pd.DataFrame({'DateMax': values},
+                        index=pd.DatetimeIndex(dates, name='Date', copy=False),
+                        copy=False)
 
 
 def make_dash_table(df: pd.DataFrame):
@@ -0,0 +1,58 @@
+# Other required packages
+import numpy as np
+import pandas as pd
+
+esg_fields: list = ['environmentScore', 'socialScore', 'governanceScore']
+
+
+def alignPrices(closes: pd.DataFrame, n_days: int = None) -> pd.DataFrame:
+    # Dense price matrix on one calendar: a row for every date on which one
+    # of the markets traded, a price carries over on days its market is
+    # closed and the dates before every ticker has a price are dropped
+    prices = closes.sort_index().ffill().dropna()
+    return prices if n_days is None else prices.tail(n_days)
+
+
+class PortfolioValuation:
+    def __init__(self, closes: pd.DataFrame, shares: pd.Series,
+                 betas: pd.Series = None, esg: pd.DataFrame = None,
+                 n_days: int = 2510):
+        # Value of a portfolio (shares per ticker) over the last n_days of
+        # the closing prices (one column per ticker). Betas (per ticker) and
+        # ESG scores (one row per ticker, esg_fields columns) are averaged
+        # with the current value of every position as weight.
+        assert set(shares.index) <= set(closes.columns), \
+            "Provide the closing prices of every ticker in the portfolio"
+        self.tickers = list(shares.index)
+        self.prices = alignPrices(closes[self.tickers], n_days)
+        P = self.prices.values
+        q = shares.values.astype(float)
+        self.positions = pd.DataFrame(P*q, index=self.prices.index,
+                                      columns=self.tickers)
+        self.value = pd.Series(P @ q, index=self.prices.index, name='Return')
+        self.weights = self.positions.iloc[-1]/self.value.iloc[-1]
+
+        # Beta and ESG in one product, a missing score leaves the ticker out
+        # of that average
+        metrics = pd.DataFrame(index=self.tickers)
+        metrics['beta'] = np.nan if betas is None else betas
+        for field in esg_fields:
+            metrics[field] = np.nan if esg is None or field not in esg \
+                else esg[field]
+        M = metrics.values.astype(float).T
+        w = self.weights.values
+        known = ~np.isnan(M)
+        with np.errstate(invalid='ignore'):
+            averages = (np.where(known, M, 0) @ w)/(known @ w)
+        self.metrics = pd.Series(averages, index=metrics.columns)
+        self.beta = self.metrics['beta']
+        self.esg = self.metrics[esg_fields]
+
+    def contributions(self) -> pd.DataFrame:
+        # Current value and weight of every position and its contribution to
+        # the return of the portfolio over the whole period
+        start, end = self.positions.iloc[0], self.positions.iloc[-1]
+        return pd.DataFrame({'value': end,
+                             'weight': self.weights,
+                             'profit': end - start,
+                             'contribution': (end - start)/self.value.iloc[0]})